@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+
+        from core import signals  # noqa: F401
+
+        if settings.SLOW_QUERY_LOG:
+            from sipi_back.slow_queries import slow_query_log
+            connection_created.connect(slow_query_log.install,
+                                       weak=False)
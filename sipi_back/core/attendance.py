@@ -0,0 +1,549 @@
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q
+
+from core.db import bulk_increment_or_create
+from core.models import Attendance, AttendanceMask, AttendanceLessonStats, \
+    AttendanceStudentStats, ChangeLog, ResourceVersion, Subject
+
+LESSONS_COUNT = 32
+
+Mark = namedtuple(
+    'Mark', 'subject_id student_id lesson_serial_number is_present')
+
+
+def lesson_bit(lesson_serial_number):
+    """
+    Получить бит занятия в маске посещаемости
+    :param lesson_serial_number: порядковый номер занятия (1..32)
+    :return: маска с одним установленным битом
+    """
+    return 1 << (lesson_serial_number - 1)
+
+
+def mark_of(attendance):
+    """
+    Получить отметку из объекта посещаемости
+    :param attendance: объект посещаемости
+    :return: Mark
+    """
+    return Mark(attendance.subject_id, attendance.student_id,
+                attendance.lesson_serial_number, attendance.is_present)
+
+
+def apply_changes(added=(), removed=()):
+    """
+    Учесть изменения отметок в производных данных посещаемости.
+    Вызывается в той же транзакции, что и изменение модели Attendance.
+    :param added: новые отметки
+    :param removed: удаленные или замененные отметки
+    :return: None
+    """
+    update_stats(added, removed)
+    clear_mask_bits(removed)
+    set_mask_bits(added)
+    ResourceVersion.objects.bump(*(
+        (ResourceVersion.ATTENDANCE, mark.subject_id)
+        for mark in (*added, *removed)))
+
+
+def discard_marks(marks):
+    """
+    Учесть удаление отметок в производных данных посещаемости. Вызывается
+    сигналом удаления Attendance, в том числе при каскадном удалении
+    студента или предмета. Счетчики только уменьшаются в существующих
+    строках: строки сводных таблиц удаляемого студента или предмета
+    могут быть уже удалены, и создавать их заново нельзя.
+    :param marks: удаленные отметки
+    :return: None
+    """
+    students = defaultdict(lambda: [0, 0])
+    lessons = defaultdict(lambda: [0, 0])
+    for mark in marks:
+        for counters in (
+            students[mark.subject_id, mark.student_id],
+            lessons[mark.subject_id, mark.lesson_serial_number],
+        ):
+            counters[0] += mark.is_present
+            counters[1] += 1
+    for (subject_id, student_id), (present, total) in students.items():
+        AttendanceStudentStats.objects.filter(
+            subject_id=subject_id, student_id=student_id
+        ).update(present=F('present') - present, total=F('total') - total)
+    for (subject_id, lesson_serial_number), (present, total) in \
+            lessons.items():
+        AttendanceLessonStats.objects.filter(
+            subject_id=subject_id, lesson_serial_number=lesson_serial_number
+        ).update(present=F('present') - present, total=F('total') - total)
+    clear_mask_bits(marks)
+    ResourceVersion.objects.bump(*(
+        (ResourceVersion.ATTENDANCE, mark.subject_id) for mark in marks))
+
+
+def lock_subjects(*subject_ids):
+    """
+    Заблокировать строки предметов до конца транзакции. Изменения отметок
+    одного предмета выполняются по очереди: иначе две транзакции,
+    добавляющие одну и ту же новую отметку, не увидели бы строки друг
+    друга и обе учли бы отметку в сводных данных.
+    :param subject_ids: id предметов
+    :return: None
+    """
+    list(Subject.objects.select_for_update().filter(
+        pk__in=subject_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def update_stats(added=(), removed=()):
+    """
+    Инкрементально обновить сводную посещаемость по студентам и занятиям
+    :param added: новые отметки
+    :param removed: удаленные или замененные отметки
+    :return: None
+    """
+    students = defaultdict(lambda: [0, 0])
+    lessons = defaultdict(lambda: [0, 0])
+    for marks, sign in ((added, 1), (removed, -1)):
+        for mark in marks:
+            for counters in (
+                students[mark.subject_id, mark.student_id],
+                lessons[mark.subject_id, mark.lesson_serial_number],
+            ):
+                counters[0] += sign * mark.is_present
+                counters[1] += sign
+    for model, key_fields, deltas in (
+        (AttendanceStudentStats, ['subject', 'student'], students),
+        (AttendanceLessonStats, ['subject', 'lesson_serial_number'], lessons),
+    ):
+        bulk_increment_or_create(
+            model, key_fields, ['present', 'total'],
+            [(keys, tuple(counters)) for keys, counters in deltas.items()
+             if any(counters)])
+
+
+def rebuild_stats():
+    """
+    Пересчитать сводную посещаемость из хранимых отметок: построчных или,
+    в компактном режиме, из масок
+    :return: (число строк по студентам, число строк по занятиям)
+    """
+    if bitset_storage():
+        student_rows, lesson_rows = stats_from_masks()
+    else:
+        counters = {'total': Count('id'),
+                    'present': Count('id', filter=Q(is_present=True))}
+        student_rows = Attendance.objects.order_by().values(
+            'subject', 'student').annotate(**counters)
+        lesson_rows = Attendance.objects.order_by().values(
+            'subject', 'lesson_serial_number').annotate(**counters)
+    AttendanceStudentStats.objects.all().delete()
+    AttendanceLessonStats.objects.all().delete()
+    students = AttendanceStudentStats.objects.bulk_create(
+        AttendanceStudentStats(subject_id=row['subject'],
+                               student_id=row['student'],
+                               present=row['present'], total=row['total'])
+        for row in student_rows
+    )
+    lessons = AttendanceLessonStats.objects.bulk_create(
+        AttendanceLessonStats(subject_id=row['subject'],
+                              lesson_serial_number=row['lesson_serial_number'],
+                              present=row['present'], total=row['total'])
+        for row in lesson_rows
+    )
+    ResourceVersion.objects.bump(*(
+        (ResourceVersion.ATTENDANCE, subject_id) for subject_id in
+        Subject.objects.values_list('pk', flat=True)))
+    return len(students), len(lessons)
+
+
+def stats_from_masks():
+    """
+    Посчитать сводную посещаемость по маскам компактного хранения
+    :return: (строки по студентам, строки по занятиям) в виде словарей
+    """
+    students = []
+    lessons = defaultdict(lambda: [0, 0])
+    for mask in AttendanceMask.objects.filter(recorded_mask__gt=0).only(
+            'subject_id', 'student_id', 'present_mask',
+            'recorded_mask').iterator():
+        marks = marks_of_mask(mask)
+        students.append({
+            'subject': mask.subject_id,
+            'student': mask.student_id,
+            'present': sum(mark.is_present for mark in marks),
+            'total': len(marks),
+        })
+        for mark in marks:
+            counters = lessons[mark.subject_id, mark.lesson_serial_number]
+            counters[0] += mark.is_present
+            counters[1] += 1
+    return students, [
+        {'subject': subject_id, 'lesson_serial_number': lesson_serial_number,
+         'present': present, 'total': total}
+        for (subject_id, lesson_serial_number), (present, total)
+        in lessons.items()
+    ]
+
+
+def percent(present, total):
+    """
+    Получить процент посещаемости
+    :return: процент, округленный до десятых
+    """
+    return round(present * 100 / total, 1) if total else 0.0
+
+
+def stats(subject):
+    """
+    Получить сводную посещаемость предмета по студентам и занятиям
+    :param subject: предмет
+    :return: словарь со списками students и lessons
+    """
+    students = AttendanceStudentStats.objects.filter(
+        subject=subject, total__gt=0
+    ).order_by('student_id').values_list(
+        'student_id', 'student__first_name', 'student__last_name',
+        'present', 'total')
+    lessons = AttendanceLessonStats.objects.filter(
+        subject=subject, total__gt=0
+    ).order_by('lesson_serial_number').values_list(
+        'lesson_serial_number', 'present', 'total')
+    return {
+        'students': [
+            {
+                'student': student_id,
+                'user_fullname': '{} {}'.format(first_name, last_name),
+                'present': present,
+                'total': total,
+                'percent': percent(present, total),
+            }
+            for student_id, first_name, last_name, present, total in students
+        ],
+        'lessons': [
+            {
+                'lesson_serial_number': lesson_serial_number,
+                'present': present,
+                'total': total,
+                'percent': percent(present, total),
+            }
+            for lesson_serial_number, present, total in lessons
+        ],
+    }
+
+
+def clear_mask_bits(marks):
+    """
+    Снять биты удаленных отметок в масках посещаемости
+    :param marks: удаленные отметки
+    :return: None
+    """
+    groups = defaultdict(list)
+    for mark in marks:
+        groups[mark.subject_id, mark.lesson_serial_number].append(
+            mark.student_id)
+    for (subject_id, lesson_serial_number), student_ids in groups.items():
+        keep = ~lesson_bit(lesson_serial_number)
+        AttendanceMask.objects.filter(
+            subject_id=subject_id, student_id__in=student_ids
+        ).update(present_mask=F('present_mask').bitand(keep),
+                 recorded_mask=F('recorded_mask').bitand(keep))
+
+
+def set_mask_bits(marks):
+    """
+    Записать отметки в маски посещаемости одним запросом
+    INSERT ... ON CONFLICT DO UPDATE
+    :param marks: новые отметки
+    :return: None
+    """
+    if not marks:
+        return
+    qn = connection.ops.quote_name
+    table = qn(AttendanceMask._meta.db_table)
+    present, recorded = qn('present_mask'), qn('recorded_mask')
+    params = []
+    for mark in marks:
+        bit = lesson_bit(mark.lesson_serial_number)
+        params += [mark.subject_id, mark.student_id,
+                   bit if mark.is_present else 0, bit]
+    sql = (
+        f'INSERT INTO {table} ({qn("subject_id")}, {qn("student_id")}, '
+        f'{present}, {recorded}) '
+        f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(marks))} '
+        f'ON CONFLICT ({qn("subject_id")}, {qn("student_id")}) DO UPDATE '
+        f'SET {present} = ({table}.{present} & ~EXCLUDED.{recorded}) '
+        f'| EXCLUDED.{present}, '
+        f'{recorded} = {table}.{recorded} | EXCLUDED.{recorded}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def masks_from_rows(subject_ids=None):
+    """
+    Собрать маски посещаемости из построчных отметок одним запросом
+    :param subject_ids: ограничить предметами, None - все предметы
+    :return: словарь {(id предмета, id студента): [present, recorded]}
+    """
+    rows = Attendance.objects.all()
+    if subject_ids is not None:
+        rows = rows.filter(subject_id__in=subject_ids)
+    masks = defaultdict(lambda: [0, 0])
+    for subject_id, student_id, lesson_serial_number, is_present in \
+            rows.values_list('subject_id', 'student_id',
+                             'lesson_serial_number', 'is_present').iterator():
+        bit = lesson_bit(lesson_serial_number)
+        mask = masks[subject_id, student_id]
+        mask[1] |= bit
+        if is_present:
+            mask[0] |= bit
+    return masks
+
+
+def matrix(subject):
+    """
+    Получить матрицу посещаемости предмета из масок: строка на
+    студента с битовыми масками присутствия и проставленных отметок
+    :param subject: предмет
+    :return: список словарей по студентам
+    """
+    rows = AttendanceMask.objects.filter(
+        subject=subject, recorded_mask__gt=0
+    ).values_list('student_id', 'student__first_name',
+                  'student__last_name', 'present_mask', 'recorded_mask')
+    return sorted(
+        (
+            {
+                'student': student_id,
+                'user_fullname': '{} {}'.format(first_name, last_name),
+                'present_mask': present_mask,
+                'recorded_mask': recorded_mask,
+            }
+            for student_id, first_name, last_name, present_mask,
+            recorded_mask in rows
+        ),
+        key=lambda row: row['student'],
+    )
+
+
+def bitset_storage():
+    """
+    Проверить, включено ли компактное хранение посещаемости. В этом режиме
+    строк Attendance нет: отметки хранятся только в масках AttendanceMask,
+    а отметка одного занятия - это бит маски.
+    :return: bool
+    """
+    return settings.ATTENDANCE_BITSET_STORAGE
+
+
+def mark_id(mask_id, lesson_serial_number):
+    """
+    Получить id отметки в компактном режиме: id строки масок и номер
+    занятия
+    :param mask_id: id строки AttendanceMask
+    :param lesson_serial_number: порядковый номер занятия (1..32)
+    :return: id отметки
+    """
+    return mask_id * LESSONS_COUNT + lesson_serial_number - 1
+
+
+def marks_of_mask(mask):
+    """
+    Развернуть строку масок в отметки по занятиям
+    :param mask: объект AttendanceMask
+    :return: список Mark
+    """
+    return [
+        Mark(mask.subject_id, mask.student_id, lesson_serial_number,
+             bool(mask.present_mask & lesson_bit(lesson_serial_number)))
+        for lesson_serial_number in range(1, LESSONS_COUNT + 1)
+        if mask.recorded_mask & lesson_bit(lesson_serial_number)
+    ]
+
+
+def stored_masks():
+    """
+    Набор строк масок с отметками для чтения отметок в компактном режиме
+    :return: QuerySet
+    """
+    return AttendanceMask.objects.select_related(
+        'subject', 'student').filter(recorded_mask__gt=0).order_by('id')
+
+
+def attendance_of_masks(masks):
+    """
+    Получить несохраняемые объекты Attendance из строк масок, чтобы
+    отдавать их теми же сериализаторами, что и построчные отметки
+    :param masks: строки AttendanceMask с загруженными subject и student
+    :return: генератор объектов Attendance
+    """
+    for mask in masks:
+        for mark in marks_of_mask(mask):
+            yield Attendance(
+                pk=mark_id(mask.pk, mark.lesson_serial_number),
+                subject=mask.subject, student=mask.student,
+                lesson_serial_number=mark.lesson_serial_number,
+                is_present=mark.is_present)
+
+
+def attendance_in_bulk(pks):
+    """
+    Загрузить отметки компактного режима по id одним запросом
+    :param pks: id отметок
+    :return: словарь {id: Attendance}
+    """
+    pks = set(pks)
+    masks = stored_masks().filter(
+        pk__in={pk // LESSONS_COUNT for pk in pks})
+    return {attendance.pk: attendance
+            for attendance in attendance_of_masks(masks)
+            if attendance.pk in pks}
+
+
+def masks_by_key(keys):
+    """
+    Загрузить строки масок по ключам отметок одним запросом
+    :param keys: ключи (id предмета, id студента, номер занятия)
+    :return: словарь {(id предмета, id студента): AttendanceMask}
+    """
+    if not keys:
+        return {}
+    masks = AttendanceMask.objects.filter(
+        subject_id__in={key[0] for key in keys},
+        student_id__in={key[1] for key in keys})
+    return {(mask.subject_id, mask.student_id): mask for mask in masks}
+
+
+def stored_marks(keys):
+    """
+    Прочитать отметки компактного режима по ключам
+    :param keys: ключи (id предмета, id студента, номер занятия)
+    :return: список Mark проставленных отметок
+    """
+    keys = set(keys)
+    masks = masks_by_key(keys)
+    return [mark for mask in masks.values() for mark in marks_of_mask(mask)
+            if mark[:3] in keys]
+
+
+def write_marks(added=(), deleted=()):
+    """
+    Записать изменения отметок в компактном режиме. Маски здесь и есть
+    хранилище: текущие отметки с теми же ключами перечитываются и
+    заменяются, сводные данные и журнал синхронизации обновляются в той же
+    транзакции. Вызывается после lock_subjects.
+    :param added: новые отметки, заменяющие отметки с теми же ключами
+    :param deleted: удаляемые отметки
+    :return: словарь {ключ отметки: id отметки} для новых отметок
+    """
+    keys = {mark[:3] for mark in (*deleted, *added)}
+    masks = masks_by_key(keys)
+    removed = [mark for mask in masks.values() for mark in marks_of_mask(mask)
+               if mark[:3] in keys]
+    apply_changes(added, removed)
+
+    added_keys = {mark[:3] for mark in added}
+    if any(key[:2] not in masks for key in added_keys):
+        # Строки масок новых студентов созданы при записи отметок
+        masks = masks_by_key(keys)
+    ids = {key: mark_id(masks[key[:2]].pk, key[2]) for key in added_keys}
+    ChangeLog.objects.record((Attendance, pk) for pk in ids.values())
+    ChangeLog.objects.record(
+        ((Attendance, mark_id(masks[mark[:2]].pk, mark.lesson_serial_number))
+         for mark in removed if mark[:3] not in added_keys),
+        ChangeLog.DELETE)
+    return ids
+
+
+def save_attendance(attendance, old_mark=None):
+    """
+    Сохранить одну отметку в компактном режиме
+    :param attendance: несохраняемый объект Attendance с новыми данными
+    :param old_mark: прежняя отметка при изменении, None при создании
+    :return: объект Attendance с id отметки
+    """
+    mark = mark_of(attendance)
+    ids = write_marks(added=[mark],
+                      deleted=[old_mark] if old_mark else [])
+    attendance.pk = ids[mark[:3]]
+    return attendance
+
+
+def discard_mask(mask):
+    """
+    Учесть удаление строки масок в компактном режиме, в том числе при
+    каскадном удалении студента или предмета: ее отметки удалены вместе
+    с ней
+    :param mask: удаленный объект AttendanceMask
+    :return: None
+    """
+    marks = marks_of_mask(mask)
+    discard_marks(marks)
+    ChangeLog.objects.record(
+        ((Attendance, mark_id(mask.pk, mark.lesson_serial_number))
+         for mark in marks), ChangeLog.DELETE)
+
+
+def attendance_rows_of_masks(masks):
+    """
+    Развернуть строки масок в строки выгрузки посещаемости
+    :param masks: QuerySet кортежей (slug предмета, id студента, логин,
+        полное имя, маска присутствия, маска отметок)
+    :return: генератор кортежей по отметкам
+    """
+    for slug, student_id, username, fullname, present_mask, recorded_mask \
+            in masks:
+        for lesson_serial_number in range(1, LESSONS_COUNT + 1):
+            bit = lesson_bit(lesson_serial_number)
+            if recorded_mask & bit:
+                yield (slug, student_id, username, fullname,
+                       lesson_serial_number, bool(present_mask & bit))
+
+
+def convert_to_masks():
+    """
+    Перенести построчные отметки в маски компактного хранения и удалить
+    строки. Строки удаляются без сигналов: сводные данные не меняются.
+    :return: число перенесенных отметок
+    """
+    masks = masks_from_rows()
+    AttendanceMask.objects.update(present_mask=0, recorded_mask=0)
+    AttendanceMask.objects.bulk_create(
+        (
+            AttendanceMask(subject_id=subject_id, student_id=student_id,
+                           present_mask=present_mask,
+                           recorded_mask=recorded_mask)
+            for (subject_id, student_id), (present_mask, recorded_mask)
+            in masks.items()
+        ),
+        update_conflicts=True,
+        unique_fields=['subject', 'student'],
+        update_fields=['present_mask', 'recorded_mask'],
+        batch_size=1000,
+    )
+    table = connection.ops.quote_name(Attendance._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        return cursor.rowcount
+
+
+def convert_to_rows():
+    """
+    Развернуть маски компактного хранения в построчные отметки. Маски
+    остаются кешем матрицы, сводные данные не меняются.
+    :return: число перенесенных отметок
+    """
+    rows = Attendance.objects.bulk_create(
+        (
+            Attendance(subject_id=mark.subject_id, student_id=mark.student_id,
+                       lesson_serial_number=mark.lesson_serial_number,
+                       is_present=mark.is_present)
+            for mask in AttendanceMask.objects.filter(
+                recorded_mask__gt=0).iterator()
+            for mark in marks_of_mask(mask)
+        ),
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    return len(rows)
@@ -0,0 +1,183 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Subquery
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, \
+    InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+from core.models import ResourceVersion
+
+
+class UserCache:
+    """
+    LRU кеш пользователей в памяти процесса с ограничением времени жизни.
+    Запись хранит версию пользователя, с которой она была загружена, и
+    время последней сверки этой версии с базой данных.
+    """
+
+    def __init__(self, max_size, ttl, recheck):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.recheck = recheck
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Получить пользователя из кеша
+        :param key: идентификатор пользователя
+        :return: (пользователь, версия, сверена ли версия недавно) или None,
+        если пользователя нет в кеше или запись устарела
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, checked, version, user = item
+            now = time.monotonic()
+            if expires < now:
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return user, version, now - checked < self.recheck
+
+    def set(self, key, version, user):
+        """
+        Положить пользователя в кеш, вытеснив самый давно использованный
+        :param key: идентификатор пользователя
+        :param version: версия пользователя на момент загрузки
+        :param user: пользователь
+        :return: None
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.items[key] = (now + self.ttl, now, version, user)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def mark_checked(self, key):
+        """
+        Запомнить, что версия пользователя только что совпала с базой
+        :param key: идентификатор пользователя
+        :return: None
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items[key] = (item[0], time.monotonic(), *item[2:])
+
+    def invalidate(self, key):
+        """
+        Удалить пользователя из кеша
+        :param key: идентификатор пользователя
+        :return: None
+        """
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        """
+        Очистить кеш
+        :return: None
+        """
+        with self.lock:
+            self.items.clear()
+
+
+user_cache = UserCache(max_size=settings.JWT_USER_CACHE['MAX_SIZE'],
+                       ttl=settings.JWT_USER_CACHE['TTL'],
+                       recheck=settings.JWT_USER_CACHE['RECHECK'])
+
+
+def user_cache_key(user_id):
+    """
+    Получить ключ кеша по идентификатору пользователя
+    :param user_id: значение поля USER_ID_FIELD или claim USER_ID_CLAIM
+    :return: ключ кеша
+    """
+    return str(user_id)
+
+
+def user_version(user_id):
+    """
+    Получить версию пользователя из общей для всех процессов таблицы
+    версий ресурсов. Версия меняется сигналом сохранения и удаления
+    пользователя.
+    :param user_id: значение claim USER_ID_CLAIM
+    :return: номер версии, 0 для пользователя без изменений
+    """
+    rows = ResourceVersion.objects.stamp((ResourceVersion.USERS, user_id))
+    return rows[0][2] if rows else 0
+
+
+class StreamToken(Token):
+    """
+    Короткоживущий токен подключения к потоку событий очереди. Передается
+    в строке запроса и может попасть в журналы, поэтому не подходит для
+    остального API и быстро истекает.
+    """
+    token_type = 'stream'
+    lifetime = settings.QUEUE_EVENTS_TOKEN_LIFETIME
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT аутентификация, берущая пользователя из кеша процесса без
+    запросов к базе данных. Сигналы сбрасывают запись в этом процессе, а
+    остальные процессы раз в JWT_USER_CACHE['RECHECK'] секунд сверяют
+    версию пользователя одним запросом и загружают его заново, если роль
+    изменилась или пользователь удален.
+    """
+
+    def get_user(self, validated_token):
+        """
+        Получить пользователя по проверенному токену
+        :param validated_token: проверенный токен
+        :return: пользователь
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                'Token contained no recognizable user identification')
+        key = user_cache_key(user_id)
+        item = user_cache.get(key)
+        if item is not None:
+            user, version, checked = item
+            if not checked:
+                if user_version(user_id) == version:
+                    user_cache.mark_checked(key)
+                else:
+                    item = None
+        if item is None:
+            user = self.load_user(user_id)
+            user_cache.set(key, user.cached_version or 0, user)
+        # Копия не дает изменениям в одном запросе попасть в другие
+        return copy.copy(user)
+
+    def load_user(self, user_id):
+        """
+        Загрузить пользователя вместе с его версией одним запросом
+        :param user_id: значение claim USER_ID_CLAIM
+        :return: пользователь с атрибутом cached_version
+        """
+        version = ResourceVersion.objects.filter(
+            resource=ResourceVersion.USERS, scope=user_id).values('version')
+        try:
+            user = self.user_model.objects.annotate(
+                cached_version=Subquery(version[:1])
+            ).get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed('User not found',
+                                       code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive',
+                                       code='user_inactive')
+        return user
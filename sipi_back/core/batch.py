@@ -0,0 +1,116 @@
+import io
+import json
+from urllib.parse import urlsplit
+
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+
+# Заголовки исходного запроса, которые наследуют вложенные запросы
+INHERITED_HEADERS = ('HTTP_HOST', 'HTTP_X_FORWARDED_FOR',
+                     'HTTP_X_FORWARDED_PROTO', 'HTTP_X_REAL_IP',
+                     'HTTP_USER_AGENT', 'HTTP_ACCEPT_LANGUAGE')
+
+
+def sub_request(request, method, path, body):
+    """
+    Создать вложенный запрос с окружением исходного. Пользователь уже
+    аутентифицирован исходным запросом и передается DRF через
+    _force_auth_user, повторной проверки JWT нет.
+    :param request: DRF запрос пакета
+    :param method: HTTP метод
+    :param path: путь с необязательной строкой запроса
+    :param body: тело запроса, сериализуемое в JSON, или None
+    :return: WSGIRequest
+    """
+    url = urlsplit(path)
+    content = b'' if body is None else json.dumps(body).encode()
+    environ = {
+        key: value for key, value in request.META.items()
+        if not key.startswith('HTTP_') and not key.startswith('CONTENT_')
+        or key in INHERITED_HEADERS
+    }
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(content),
+    })
+    sub = WSGIRequest(environ)
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def response_body(response):
+    """
+    Получить тело ответа вложенного запроса
+    :param response: ответ представления
+    :return: разобранный JSON, текст или None
+    """
+    if hasattr(response, 'render'):
+        response.render()
+    content = b''.join(response) if response.streaming else response.content
+    is_json = response.get('Content-Type', '').startswith('application/json')
+    if is_json and content:
+        return json.loads(content)
+    # Страница ошибки Django не нужна клиенту, важен только статус
+    if not content or response.status_code >= 500:
+        return None
+    return content.decode(response.charset or 'utf-8', errors='replace')
+
+
+def dispatch(request, item):
+    """
+    Выполнить вложенный запрос через обычный URLconf и представления.
+    Цепочка middleware не выполняется: вложенные запросы не попадают в
+    журнал запросов и метрики, для них не проверяется query_budget, эти
+    проверки относятся к запросу пакета целиком. Исключения представления
+    превращаются в ответ так же, как это делает обработчик Django, и
+    не прерывают остальные запросы пакета.
+    :param request: DRF запрос пакета
+    :param item: словарь с method, path и body
+    :return: словарь с status, headers и body ответа
+    """
+    try:
+        match = resolve(urlsplit(item['path']).path)
+    except Resolver404:
+        return {'status': 404, 'headers': {},
+                'body': {'detail': 'Not found.'}}
+    callback = convert_exception_to_response(match.func)
+    response = callback(
+        sub_request(request, item['method'], item['path'], item['body']),
+        *match.args, **match.kwargs)
+    body = response_body(response)
+    headers = {name: value for name, value in response.items()
+               if name in ('Location', 'ETag', 'Content-Type')}
+    return {'status': response.status_code, 'headers': headers,
+            'body': body}
+
+
+def run(request, items, atomic):
+    """
+    Выполнить пакет запросов по порядку. В атомарном режиме все запросы
+    выполняются в одной транзакции, а первый ответ с ошибкой (статус
+    400 и выше, в том числе 500 из-за исключения в представлении)
+    останавливает пакет и откатывает изменения.
+    :param request: DRF запрос пакета
+    :param items: вложенные запросы
+    :param atomic: выполнять в одной транзакции
+    :return: словарь с results и rolled_back
+    """
+    if not atomic:
+        return {'results': [dispatch(request, item) for item in items],
+                'rolled_back': False}
+    results = []
+    with transaction.atomic():
+        for item in items:
+            results.append(dispatch(request, item))
+            if results[-1]['status'] >= 400:
+                transaction.set_rollback(True)
+                return {'results': results, 'rolled_back': True}
+    return {'results': results, 'rolled_back': False}
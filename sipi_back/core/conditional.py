@@ -0,0 +1,82 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Subquery
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control, patch_vary_headers
+
+from core.models import ResourceVersion, Subject
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def subject_scope(resource):
+    """
+    Ключ версии ресурса предмета из параметра запроса subject (slug).
+    Id предмета подставляется подзапросом, отдельный запрос не нужен.
+    :param resource: имя ресурса
+    :return: функция request -> список ключей или None без параметра
+    """
+    def keys(request):
+        slug = request.query_params.get('subject')
+        if not slug:
+            return None
+        return [(resource, Subquery(
+            Subject.objects.filter(slug=slug).values('pk')[:1]))]
+    return keys
+
+
+def compute_etag(request, keys, per_user):
+    """
+    Вычислить сильный ETag ответа по версиям ресурсов без выполнения
+    основных запросов представления
+    :param request: DRF запрос
+    :param keys: пары (ресурс, область)
+    :param per_user: ответ зависит от пользователя
+    :return: ETag в кавычках
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(ResourceVersion.objects.stamp(*keys)).encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(request.accepted_renderer.format.encode())
+    if per_user:
+        digest.update(f'user:{request.user.pk}'.encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def versioned(*keys, per_user=False):
+    """
+    Декоратор действия ViewSet для условных GET запросов. ETag строится
+    по версиям ресурсов, и при совпадении с If-None-Match возвращается
+    304 без запросов данных и сериализации.
+    :param keys: пары (ресурс, область) или функции request -> список пар
+    :param per_user: ответ зависит от пользователя
+    :return: декоратор
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return method(view, request, *args, **kwargs)
+            resolved = []
+            for key in keys:
+                if callable(key):
+                    key = key(request)
+                    if key is None:
+                        return method(view, request, *args, **kwargs)
+                    resolved.extend(key)
+                else:
+                    resolved.append(key)
+            etag = compute_etag(request, resolved, per_user)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.headers.setdefault('ETag', etag)
+            # Клиент должен перепроверять ответ при каждом обращении
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        return wrapper
+    return decorator
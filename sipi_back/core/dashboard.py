@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+
+from core.models import Poll, Queue, Subject
+from core.serializers import PollSerializer, SubjectSerializer, \
+    UsersSerializer
+
+
+class Timings:
+    """
+    Время сборки разделов ответа для заголовка Server-Timing
+    """
+
+    def __init__(self):
+        self.sections = []
+
+    @contextmanager
+    def section(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.append(
+                (name, (time.perf_counter() - started) * 1000))
+
+    def header(self):
+        """
+        Получить значение заголовка Server-Timing
+        :return: строка вида "subjects;dur=1.2, polls;dur=3.4"
+        """
+        return ', '.join(f'{name};dur={duration:.1f}'
+                         for name, duration in self.sections)
+
+
+def build(request):
+    """
+    Собрать данные стартового экрана клиента: пользователь, предметы,
+    места пользователя в очередях и опросы. Выполняется постоянное число
+    запросов: предметы, места в очередях, опросы, варианты и голоса.
+    :param request: DRF запрос
+    :return: (словарь ответа, Timings)
+    """
+    timings = Timings()
+    context = {'request': request}
+    with timings.section('user'):
+        user = UsersSerializer(request.user, context=context).data
+    with timings.section('subjects'):
+        subjects = list(Subject.objects.all())
+        subjects_data = SubjectSerializer(subjects, many=True,
+                                          context=context).data
+    with timings.section('queues'):
+        positions = Queue.objects.positions(request.user)
+        queues = [
+            {'subject': subject.slug,
+             'position': positions.get(subject.pk),
+             'queue_length': subject.queue_size}
+            for subject in subjects
+        ]
+    with timings.section('polls'):
+        polls = PollSerializer(
+            Poll.objects.with_choices().with_user_votes(request.user),
+            many=True, context=context).data
+    return {'user': user, 'subjects': subjects_data, 'queues': queues,
+            'polls': polls}, timings
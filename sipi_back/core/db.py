@@ -0,0 +1,50 @@
+from django.db import connection
+
+
+def increment_or_create(model, lookup, **increments):
+    """
+    Увеличить счетчики строки модели или создать ее одним запросом
+    INSERT ... ON CONFLICT DO UPDATE. По полям lookup должно существовать
+    ограничение уникальности.
+    :param model: класс модели
+    :param lookup: словарь {имя поля: значение}, идентифицирующий строку
+    :param increments: приращения счетчиков {имя поля: значение}
+    :return: None
+    """
+    bulk_increment_or_create(
+        model, list(lookup), list(increments),
+        [(tuple(lookup.values()), tuple(increments.values()))])
+
+
+def bulk_increment_or_create(model, key_fields, counter_fields, rows):
+    """
+    Увеличить счетчики нескольких строк модели или создать их одним
+    запросом INSERT ... ON CONFLICT DO UPDATE
+    :param model: класс модели
+    :param key_fields: имена полей с ограничением уникальности
+    :param counter_fields: имена полей счетчиков
+    :param rows: список пар (значения ключа, приращения счетчиков)
+    :return: None
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    key_columns = [qn(opts.get_field(name).column) for name in key_fields]
+    counter_columns = [qn(opts.get_field(name).column)
+                       for name in counter_fields]
+    columns = key_columns + counter_columns
+    placeholders = f'({", ".join(["%s"] * len(columns))})'
+    updates = ', '.join(
+        f'{column} = {table}.{column} + EXCLUDED.{column}'
+        for column in counter_columns
+    )
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) '
+        f'VALUES {", ".join([placeholders] * len(rows))} '
+        f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {updates}'
+    )
+    params = [value for keys, counters in rows for value in (*keys, *counters)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
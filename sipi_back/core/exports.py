@@ -0,0 +1,109 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet, Value
+from django.db.models.functions import Concat
+
+from core import attendance as attendance_data
+from core.models import Attendance, AttendanceMask, Choice, Queue
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+CHUNK_SIZE = 2000
+
+
+def fullname(relation):
+    """
+    Выражение полного имени пользователя по связи
+    :param relation: имя связи с пользователем
+    :return: выражение Concat
+    """
+    return Concat(f'{relation}__first_name', Value(' '),
+                  f'{relation}__last_name')
+
+
+def attendance_rows(subject_slug=None):
+    """
+    Строки выгрузки посещаемости. В компактном режиме строки получаются
+    разворачиванием масок.
+    :param subject_slug: slug предмета для фильтрации, None - все предметы
+    :return: (список колонок, QuerySet или генератор кортежей)
+    """
+    columns = ['subject', 'student', 'username', 'user_fullname',
+               'lesson_serial_number', 'is_present']
+    if attendance_data.bitset_storage():
+        masks = AttendanceMask.objects.filter(recorded_mask__gt=0).order_by(
+            'subject_id', 'student_id')
+        if subject_slug:
+            masks = masks.filter(subject__slug=subject_slug)
+        return columns, attendance_data.attendance_rows_of_masks(
+            masks.values_list(
+                'subject__slug', 'student_id', 'student__username',
+                fullname('student'), 'present_mask', 'recorded_mask'
+            ).iterator(chunk_size=CHUNK_SIZE))
+    queryset = Attendance.objects.order_by(
+        'subject_id', 'student_id', 'lesson_serial_number')
+    if subject_slug:
+        queryset = queryset.filter(subject__slug=subject_slug)
+    return columns, queryset.values_list(
+        'subject__slug', 'student_id', 'student__username',
+        fullname('student'), 'lesson_serial_number', 'is_present')
+
+
+def queue_rows(subject_slug=None):
+    """
+    Строки выгрузки очередей
+    :param subject_slug: slug предмета для фильтрации, None - все предметы
+    :return: (список колонок, QuerySet кортежей)
+    """
+    columns = ['subject', 'username', 'user_fullname', 'timestamp']
+    queryset = Queue.objects.order_by('subject_id', 'timestamp', 'id')
+    if subject_slug:
+        queryset = queryset.filter(subject__slug=subject_slug)
+    return columns, queryset.values_list(
+        'subject__slug', 'user__username', fullname('user'), 'timestamp')
+
+
+def poll_rows():
+    """
+    Строки выгрузки результатов опросов
+    :return: (список колонок, QuerySet кортежей)
+    """
+    columns = ['poll', 'poll_title', 'choice', 'choice_text', 'votes']
+    queryset = Choice.objects.with_totals().order_by('poll_id', 'id')
+    return columns, queryset.values_list(
+        'poll_id', 'poll__title', 'id', 'text', 'total_votes')
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer, возвращающий записанную строку
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream(columns, queryset, export_format):
+    """
+    Построчно выгрузить QuerySet без загрузки всех строк в память
+    :param columns: названия колонок
+    :param queryset: QuerySet или генератор кортежей
+    :param export_format: csv или jsonl
+    :return: генератор строк ответа
+    """
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE) \
+        if isinstance(queryset, QuerySet) else queryset
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder,
+                             ensure_ascii=False) + '\n'
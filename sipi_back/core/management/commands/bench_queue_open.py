@@ -0,0 +1,259 @@
+import json
+import math
+import multiprocessing
+import secrets
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import Queue, Subject
+from users.models import User
+
+BENCH_PREFIX = 'bench_'
+
+
+def _post(url, token, payload, timeout):
+    """
+    Отправить POST запрос с JSON телом
+    :return: HTTP статус ответа
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={'Authorization': f'Bearer {token}',
+                 'Content-Type': 'application/json'},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+    except OSError:
+        return 0
+
+
+def _join_queue(url, token, username, slug, start_event, schedule, delay,
+                timeout):
+    """
+    Дождаться открытия очереди и встать в нее в назначенное время
+    schedule.value + delay (время по часам системы, общим для процессов)
+    :return: (имя пользователя, время отправки, время ответа, статус,
+    опоздание отправки относительно назначенного времени в секундах)
+    """
+    start_event.wait()
+    target = schedule.value + delay
+    time.sleep(max(0.0, target - time.time()))
+    lateness = time.time() - target
+    sent = time.monotonic()
+    status = _post(url, token, {'subject': slug}, timeout)
+    return username, sent, time.monotonic(), status, lateness
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def _inversions(order, expected):
+    """
+    Посчитать число пар, стоящих в очереди не в порядке отправки
+    """
+    index = {username: i for i, username in enumerate(expected)}
+    positions = [index[username] for username in order if username in index]
+    return sum(
+        1
+        for i in range(len(positions))
+        for j in range(i + 1, len(positions))
+        if positions[i] > positions[j]
+    )
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест открытия очереди: N пользователей ' \
+           'одновременно встают в очередь сразу после ее открытия. ' \
+           'Сервер должен быть запущен на той же базе данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Размер пула (по умолчанию равен --users)')
+        parser.add_argument('--mode', choices=('thread', 'process'),
+                            default='thread')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--timeout', type=float, default=30.0)
+        parser.add_argument('--stagger-ms', type=float, default=10.0,
+                            help='Интервал между отправками запросов. '
+                                 'Порядок очереди проверяется только при '
+                                 'интервале больше нуля: одновременные '
+                                 'запросы не имеют порядка прихода')
+        parser.add_argument('--keep', action='store_true',
+                            help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        users_count = options['users']
+        if users_count < 1:
+            raise CommandError('--users must be positive.')
+        workers = options['workers'] or users_count
+        base_url = options['base_url'].rstrip('/')
+        timeout = options['timeout']
+
+        # Удаляются только объекты, созданные этим запуском: данные
+        # параллельных или сохраненных через --keep запусков не трогаются
+        self.subject_ids, self.user_ids = [], []
+        try:
+            subject, moderator, students = self.seed(users_count)
+            stagger = options['stagger_ms'] / 1000
+            results = self.run(subject, moderator, students, workers,
+                               options['mode'], base_url, timeout, stagger)
+            self.report(subject, results, stagger)
+        finally:
+            if not options['keep']:
+                Subject.objects.filter(pk__in=self.subject_ids).delete()
+                User.objects.filter(pk__in=self.user_ids).delete()
+
+    def seed(self, users_count):
+        """
+        Создать закрытый предмет, модератора и студентов. Имена и шифры
+        содержат метку запуска, чтобы не пересекаться с другими запусками.
+        """
+        run_tag = secrets.token_hex(3)
+        prefix = f'{BENCH_PREFIX}{run_tag}_'
+        subject = Subject.objects.create(title=f'{prefix}{int(time.time())}',
+                                         is_open=False)
+        self.subject_ids.append(subject.pk)
+        moderator = User.objects.create(
+            username=f'{prefix}moderator',
+            personal_cipher=f'b{run_tag}m',
+            role=User.MODERATOR,
+        )
+        self.user_ids.append(moderator.pk)
+        usernames = [f'{prefix}{i}' for i in range(users_count)]
+        with transaction.atomic():
+            User.objects.bulk_create(
+                User(username=username, personal_cipher=f'b{run_tag}{i}',
+                     first_name='Bench', last_name=str(i))
+                for i, username in enumerate(usernames)
+            )
+        # bulk_create возвращает id не на всех СУБД
+        students = list(User.objects.filter(username__in=usernames))
+        self.user_ids += [student.pk for student in students]
+        return subject, moderator, students
+
+    def run(self, subject, moderator, students, workers, mode, base_url,
+            timeout, stagger):
+        """
+        Открыть очередь и отправить запросы на вступление из пула. Запрос
+        i-го пользователя отправляется через i * stagger секунд после
+        общего старта.
+        """
+        queue_url = f'{base_url}/api/queue/'
+        tokens = {user.username: str(AccessToken.for_user(user))
+                  for user in students}
+        if mode == 'process':
+            manager = multiprocessing.Manager()
+            start_event = manager.Event()
+            schedule = manager.Value('d', 0.0)
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            manager = None
+            start_event = threading.Event()
+            schedule = types.SimpleNamespace(value=0.0)
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        # Соединение нельзя разделять с дочерними процессами
+        connection.close()
+        with executor:
+            futures = [
+                executor.submit(_join_queue, queue_url, tokens[username],
+                                username, subject.slug, start_event,
+                                schedule, index * stagger, timeout)
+                for index, username in enumerate(tokens)
+            ]
+            # Дать пулу время поднять воркеры до открытия очереди
+            time.sleep(min(1.0, 0.01 * len(futures)))
+            status = _post(f'{base_url}/api/subjects/access/',
+                           str(AccessToken.for_user(moderator)),
+                           {'subject_slug': subject.slug, 'is_open': True},
+                           timeout)
+            if status != 200:
+                start_event.set()
+                raise CommandError(
+                    f'Could not open queue, server answered {status}.')
+            # Запас, чтобы все воркеры проснулись до первой отправки
+            schedule.value = time.time() + 0.2
+            start_event.set()
+            results = [future.result() for future in futures]
+        if manager is not None:
+            manager.shutdown()
+        return results
+
+    def report(self, subject, results, stagger):
+        """
+        Вывести пропускную способность, задержки, ошибки и порядок очереди.
+        Порядок очереди сравнивается с назначенным порядком отправки, а не
+        с замеренным временем отправки: при одновременном старте оно
+        отличается на микросекунды и не задает порядок прихода.
+        """
+        latencies = [(done - sent) * 1000 for _, sent, done, _, _ in results]
+        started = min(sent for _, sent, _, _, _ in results)
+        finished = max(done for _, _, done, _, _ in results)
+        elapsed = finished - started
+        statuses = {}
+        for _, _, _, status, _ in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        errors = sum(count for status, count in statuses.items()
+                     if status != 201)
+        # Одинаковое опоздание всех отправок порядок не меняет, важен разброс
+        lateness = [result[4] for result in results]
+        jitter = (max(lateness) - min(lateness)) * 1000
+
+        accepted = {username for username, _, _, status, _ in results
+                    if status == 201}
+        # results идут в порядке назначенных времен отправки
+        expected = [username for username, *_ in results
+                    if username in accepted]
+        order = list(Queue.objects.filter(subject=subject).values_list(
+            'user__username', flat=True))
+        inversions = _inversions(order, expected)
+
+        self.stdout.write(f'Backend: {connection.vendor}')
+        self.stdout.write(f'Requests: {len(results)}, '
+                          f'elapsed: {elapsed:.3f}s, '
+                          f'throughput: {len(results) / elapsed:.1f} req/s')
+        self.stdout.write(
+            'Latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}'.format(
+                _percentile(latencies, 50), _percentile(latencies, 95),
+                _percentile(latencies, 99), max(latencies)))
+        self.stdout.write('Statuses: ' + ', '.join(
+            f'{status or "connection error"}: {count}'
+            for status, count in sorted(statuses.items())))
+        self.stdout.write(f'Errors: {errors}')
+        self.stdout.write(f'Queue size: {len(order)}, '
+                          f'accepted: {len(accepted)}')
+        self.stdout.write(f'Send stagger: {stagger * 1000:.1f}ms, '
+                          f'send jitter: {jitter:.1f}ms')
+        if stagger <= 0:
+            self.stdout.write('Queue order not checked: requests were sent '
+                              'simultaneously (use --stagger-ms).')
+        elif order == expected:
+            self.stdout.write(self.style.SUCCESS(
+                'Queue order matches send order.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Queue order differs from send order: '
+                f'{inversions} inverted pairs.'))
+        if 0 < stagger * 1000 < jitter:
+            self.stdout.write(self.style.WARNING(
+                'Send jitter exceeds the stagger interval, the order '
+                'check is not reliable: increase --stagger-ms.'))
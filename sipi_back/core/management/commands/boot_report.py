@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Загрузка воркера так же, как это делает gunicorn при первом запросе
+BOOT_SCRIPT = '''
+import json, resource
+import sipi_back.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+usage = resource.getrusage(resource.RUSAGE_SELF)
+print(json.dumps({"rss_kb": usage.ru_maxrss}))
+'''
+
+
+def parse_importtime(output):
+    """
+    Разобрать вывод python -X importtime
+    :param output: stderr процесса
+    :return: список (модуль, собственное время мкс, общее время мкс, глубина)
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = \
+            line[len('import time:'):].split('|')
+        if name.strip() == 'imported package':
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us),
+                        depth))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Отчет о загрузке воркера: время загрузки, пиковая память ' \
+           'процесса и самые медленные при импорте модули.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Сколько модулей показать')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести отчет в JSON для сравнения '
+                                 'между сборками')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+            cwd=settings.BASE_DIR, env=os.environ.copy(),
+            capture_output=True, text=True,
+        )
+        elapsed = time.monotonic() - started
+        if process.returncode != 0:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+
+        modules = parse_importtime(process.stderr)
+        top_level = [module for module in modules if module[3] == 0]
+        report = {
+            'boot_seconds': round(elapsed, 3),
+            'import_seconds': round(
+                sum(module[2] for module in top_level) / 1e6, 3),
+            'rss_kb': json.loads(process.stdout.strip().splitlines()[-1])[
+                'rss_kb'],
+            'modules_count': len(modules),
+            'api_docs_enabled': settings.API_DOCS_ENABLED,
+            'slowest_modules': [
+                {'module': name, 'self_ms': round(self_us / 1000, 2),
+                 'cumulative_ms': round(cumulative_us / 1000, 2)}
+                for name, self_us, cumulative_us, _ in sorted(
+                    modules, key=lambda module: -module[2]
+                )[:options['limit']]
+            ],
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f'Boot: {report["boot_seconds"]:.3f}s, '
+                          f'imports: {report["import_seconds"]:.3f}s, '
+                          f'modules: {report["modules_count"]}, '
+                          f'max RSS: {report["rss_kb"] / 1024:.1f} MiB, '
+                          f'API docs: {report["api_docs_enabled"]}')
+        self.stdout.write(f'{"cumulative ms":>14} {"self ms":>9}  module')
+        for module in report['slowest_modules']:
+            self.stdout.write(f'{module["cumulative_ms"]:>14.1f} '
+                              f'{module["self_ms"]:>9.1f}  '
+                              f'{module["module"]}')
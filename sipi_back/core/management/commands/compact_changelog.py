@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.sync import compact
+
+
+class Command(BaseCommand):
+    help = 'Сжать журнал изменений для /api/sync/: оставить последнюю ' \
+           'запись по каждому объекту и удалить старые записи об удалении.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.CHANGELOG_RETENTION_DAYS,
+                            help='Срок хранения записей об удалении')
+
+    def handle(self, *args, **options):
+        superseded, deleted = compact(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {superseded} superseded and {deleted} expired '
+            f'change log entries.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from core.attendance import bitset_storage, convert_to_masks, \
+    convert_to_rows
+from core.models import ChangeLog, ResourceVersion, Subject
+
+
+class Command(BaseCommand):
+    help = 'Перенести отметки посещаемости между построчным и компактным ' \
+           '(битовые маски) хранением. Запускается после смены ' \
+           'ATTENDANCE_BITSET_STORAGE при остановленных воркерах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=['bitset', 'rows'],
+                            help='Целевой режим хранения')
+
+    def handle(self, *args, **options):
+        bitset = options['storage'] == 'bitset'
+        if bitset != bitset_storage():
+            raise CommandError(
+                f'Set ATTENDANCE_BITSET_STORAGE={bitset} before converting '
+                f'attendance to {options["storage"]} storage.')
+        with transaction.atomic():
+            converted = convert_to_masks() if bitset else convert_to_rows()
+            # id отметок в режимах разные: клиенты синхронизации получат
+            # reset и загрузят посещаемость заново
+            seq = ChangeLog.objects.aggregate(seq=Max('id'))['seq']
+            if seq:
+                ChangeLog.objects.set_horizon(seq)
+            ResourceVersion.objects.bump(*(
+                (ResourceVersion.ATTENDANCE, subject_id) for subject_id in
+                Subject.objects.values_list('pk', flat=True)))
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {converted} attendance marks to '
+            f'{options["storage"]} storage.'))
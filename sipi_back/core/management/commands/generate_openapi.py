@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from sipi_back.openapi import write_files
+
+
+class Command(BaseCommand):
+    help = 'Сгенерировать схему OpenAPI в OPENAPI_SCHEMA_DIR. Выполняется ' \
+           'при развертывании, сервер отдает готовые файлы.'
+
+    def handle(self, *args, **options):
+        for path in write_files():
+            self.stdout.write(self.style.SUCCESS(f'Written {path}'))
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.serializers import UsersImportSerializer
+from core.users_import import credentials_csv, parse_users
+
+
+class Command(BaseCommand):
+    help = 'Массово создать пользователей из CSV или JSON файла и ' \
+           'сохранить сгенерированные пароли в CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV или JSON файл с пользователями')
+        parser.add_argument('--output', default='credentials.csv',
+                            help='Файл для учетных данных')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        try:
+            users = parse_users(path.read_bytes(), path.name)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        serializer = UsersImportSerializer(data={'users': users})
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        created = serializer.save()
+        Path(options['output']).write_text(credentials_csv(created),
+                                           encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created)} users, credentials saved to '
+            f'{options["output"]}.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.attendance import bitset_storage, masks_from_rows
+from core.models import AttendanceMask
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать кеш масок посещаемости из построчных отметок'
+
+    def handle(self, *args, **options):
+        if bitset_storage():
+            raise CommandError(
+                'Attendance masks are the storage in bitset mode, '
+                'there are no rows to rebuild them from.')
+        masks = masks_from_rows()
+        with transaction.atomic():
+            AttendanceMask.objects.all().delete()
+            AttendanceMask.objects.bulk_create(
+                (
+                    AttendanceMask(subject_id=subject_id,
+                                   student_id=student_id,
+                                   present_mask=present_mask,
+                                   recorded_mask=recorded_mask)
+                    for (subject_id, student_id), (present_mask,
+                                                   recorded_mask)
+                    in masks.items()
+                ),
+                batch_size=1000,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Attendance masks rebuilt for {len(masks)} students.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.attendance import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать сводную посещаемость по студентам и занятиям'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            students, lessons = rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Attendance stats rebuilt: {students} student rows, '
+            f'{lessons} lesson rows.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from core.models import Queue, ResourceVersion, Subject
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать счетчики размера очередей по предметам'
+
+    def handle(self, *args, **options):
+        queue_sizes = Queue.objects.filter(
+            subject=OuterRef('pk')
+        ).order_by().values('subject').annotate(
+            size=Count('id')
+        ).values('size')
+        with transaction.atomic():
+            updated = Subject.objects.update(
+                queue_size=Coalesce(Subquery(queue_sizes), Value(0)))
+            ResourceVersion.objects.bump((ResourceVersion.SUBJECTS, 0))
+        self.stdout.write(self.style.SUCCESS(
+            f'Queue counters rebuilt for {updated} subjects.'))
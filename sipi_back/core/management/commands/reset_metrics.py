@@ -0,0 +1,19 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Удалить сохраненные счетчики запросов воркеров. Выполняется ' \
+           'перед запуском сервера, чтобы не суммировать прошлые запуски.'
+
+    def handle(self, *args, **options):
+        removed = 0
+        if settings.METRICS_DIR.exists():
+            for path in settings.METRICS_DIR.iterdir():
+                if path.suffix in ('.json', '.tmp'):
+                    os.remove(path)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {removed} metrics files.'))
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_queue_size(apps, schema_editor):
+    Subject = apps.get_model('core', 'Subject')
+    Queue = apps.get_model('core', 'Queue')
+    queue_sizes = Queue.objects.filter(
+        subject=OuterRef('pk')
+    ).order_by().values('subject').annotate(
+        size=Count('id')
+    ).values('size')
+    Subject.objects.update(
+        queue_size=Coalesce(Subquery(queue_sizes), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_subject_is_open'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='queue_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_queue_size, migrations.RunPython.noop),
+    ]
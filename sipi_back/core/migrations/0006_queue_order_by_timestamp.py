@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_subject_queue_size'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='queue',
+            options={'ordering': ('timestamp', 'id')},
+        ),
+    ]
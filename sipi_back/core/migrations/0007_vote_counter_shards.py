@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_queue_order_by_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='sharded_votes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ChoiceVoteShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_shards', to='core.choice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='choicevoteshard',
+            constraint=models.UniqueConstraint(fields=('choice', 'shard'), name='unique_choice_shard'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def copy_voters(apps, schema_editor):
+    Choice = apps.get_model('core', 'Choice')
+    Vote = apps.get_model('core', 'Vote')
+    Voters = Choice.voters.through
+    rows = list(Voters.objects.values_list(
+        'choice_id', 'choice__poll_id', 'user_id'))
+    multiple = set(
+        Voters.objects.values('choice__poll_id', 'user_id').annotate(
+            count=Count('id')
+        ).filter(count__gt=1).values_list('choice__poll_id', 'user_id')
+    )
+    Vote.objects.bulk_create(
+        Vote(choice_id=choice_id, poll_id=poll_id, user_id=user_id,
+             is_multiple=(poll_id, user_id) in multiple)
+        for choice_id, poll_id, user_id in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0007_vote_counter_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='multiple_choice',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_multiple', models.BooleanField(default=False)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.choice')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['poll', 'user'], name='vote_poll_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('choice', 'user'), name='unique_choice_vote'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_multiple', False)), fields=('poll', 'user'), name='unique_poll_vote'),
+        ),
+        migrations.RunPython(copy_voters, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='choice',
+            name='voters',
+        ),
+        migrations.AddField(
+            model_name='choice',
+            name='voters',
+            field=models.ManyToManyField(blank=True, through='core.Vote', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_vote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['subject', 'timestamp', 'id'], name='queue_subject_order_idx'),
+        ),
+    ]
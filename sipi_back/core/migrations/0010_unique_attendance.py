@@ -0,0 +1,25 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicates(apps, schema_editor):
+    Attendance = apps.get_model('core', 'Attendance')
+    latest = Attendance.objects.values(
+        'subject', 'student', 'lesson_serial_number'
+    ).annotate(last_id=Max('id')).values_list('last_id', flat=True)
+    Attendance.objects.exclude(id__in=list(latest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_queue_subject_order_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('subject', 'student', 'lesson_serial_number'), name='unique_attendance'),
+        ),
+    ]
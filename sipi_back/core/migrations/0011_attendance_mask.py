@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0010_unique_attendance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceMask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present_mask', models.BigIntegerField(default=0)),
+                ('recorded_mask', models.BigIntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.subject')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attendancemask',
+            constraint=models.UniqueConstraint(fields=('subject', 'student'), name='unique_attendance_mask'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:44
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    Attendance = apps.get_model('core', 'Attendance')
+    StudentStats = apps.get_model('core', 'AttendanceStudentStats')
+    LessonStats = apps.get_model('core', 'AttendanceLessonStats')
+    counters = {'total': Count('id'),
+                'present': Count('id', filter=Q(is_present=True))}
+    StudentStats.objects.bulk_create(
+        StudentStats(subject_id=row['subject'], student_id=row['student'],
+                     present=row['present'], total=row['total'])
+        for row in Attendance.objects.order_by().values(
+            'subject', 'student').annotate(**counters)
+    )
+    LessonStats.objects.bulk_create(
+        LessonStats(subject_id=row['subject'],
+                    lesson_serial_number=row['lesson_serial_number'],
+                    present=row['present'], total=row['total'])
+        for row in Attendance.objects.order_by().values(
+            'subject', 'lesson_serial_number').annotate(**counters)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0011_attendance_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceStudentStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.subject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AttendanceLessonStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lesson_serial_number', models.PositiveSmallIntegerField()),
+                ('present', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.subject')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attendancestudentstats',
+            constraint=models.UniqueConstraint(fields=('subject', 'student'), name='unique_attendance_student_stats'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancelessonstats',
+            constraint=models.UniqueConstraint(fields=('subject', 'lesson_serial_number'), name='unique_attendance_lesson_stats'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_attendance_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=32)),
+                ('scope', models.BigIntegerField(default=0)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='resourceversion',
+            constraint=models.UniqueConstraint(fields=('resource', 'scope'), name='unique_resource_version'),
+        ),
+    ]
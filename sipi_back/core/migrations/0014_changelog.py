@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_resource_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Создание или изменение'), ('delete', 'Удаление')], max_length=6)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['model', 'object_id', 'id'], name='changelog_object_idx'),
+        ),
+    ]
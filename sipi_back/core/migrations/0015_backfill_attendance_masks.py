@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def fill_masks(apps, schema_editor):
+    Attendance = apps.get_model('core', 'Attendance')
+    AttendanceMask = apps.get_model('core', 'AttendanceMask')
+    masks = {}
+    for subject_id, student_id, lesson_serial_number, is_present in \
+            Attendance.objects.order_by().values_list(
+                'subject_id', 'student_id', 'lesson_serial_number',
+                'is_present').iterator():
+        bit = 1 << (lesson_serial_number - 1)
+        mask = masks.setdefault((subject_id, student_id), [0, 0])
+        mask[1] |= bit
+        if is_present:
+            mask[0] |= bit
+    AttendanceMask.objects.all().delete()
+    AttendanceMask.objects.bulk_create(
+        (
+            AttendanceMask(subject_id=subject_id, student_id=student_id,
+                           present_mask=present_mask,
+                           recorded_mask=recorded_mask)
+            for (subject_id, student_id), (present_mask, recorded_mask)
+            in masks.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_changelog'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+def move_horizon(apps, schema_editor):
+    ResourceVersion = apps.get_model('core', 'ResourceVersion')
+    ChangeLogHorizon = apps.get_model('core', 'ChangeLogHorizon')
+    rows = ResourceVersion.objects.filter(resource='changelog_horizon')
+    seq = rows.values_list('version', flat=True).first()
+    if seq is not None:
+        ChangeLogHorizon.objects.create(pk=1, seq=seq)
+    rows.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_backfill_attendance_masks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogHorizon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(move_horizon, migrations.RunPython.noop),
+    ]
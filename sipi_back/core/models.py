@@ -1,8 +1,10 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 from unidecode import unidecode
 
+from core.db import bulk_increment_or_create
 from users.models import User
 
 
@@ -13,12 +15,116 @@ class Subject(models.Model):
     title = models.CharField(max_length=128, unique=True)
     slug = models.SlugField(max_length=40, unique=True)
     is_open = models.BooleanField(default=False)
+    queue_size = models.PositiveIntegerField(default=0)
 
     def save(self, *args, **kwargs):
         self.slug = slugify(unidecode(self.title))
         super().save(*args, **kwargs)
 
 
+class QueueManager(models.Manager):
+    """
+    Менеджер очереди
+    """
+
+    def join(self, user, subject, timestamp):
+        """
+        Встать в очередь одним запросом INSERT ... ON CONFLICT DO NOTHING.
+        Проверка открытости очереди, уникальности и вставка выполняются
+        атомарно на стороне базы данных.
+        :param user: пользователь, встающий в очередь
+        :param subject: предмет
+        :param timestamp: время получения запроса сервером
+        :return: объект очереди или None, если очередь закрыта или
+        пользователь уже в ней
+        """
+        qn = connection.ops.quote_name
+        sql = (
+            f'INSERT INTO {qn(self.model._meta.db_table)} '
+            f'({qn("user_id")}, {qn("subject_id")}, {qn("timestamp")}) '
+            f'SELECT %s, {qn("id")}, %s '
+            f'FROM {qn(Subject._meta.db_table)} '
+            f'WHERE {qn("id")} = %s AND {qn("is_open")} = %s '
+            f'ON CONFLICT ({qn("subject_id")}, {qn("user_id")}) DO NOTHING'
+        )
+        params = [user.pk, connection.ops.adapt_datetimefield_value(timestamp),
+                  subject.pk, True]
+        returning = connection.features.can_return_columns_from_insert
+        if returning:
+            sql += f' RETURNING {qn("id")}'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if returning:
+                row = cursor.fetchone()
+                pk = row[0] if row else None
+            else:
+                pk = cursor.lastrowid if cursor.rowcount == 1 else None
+            if pk is None:
+                return None
+            Subject.objects.filter(pk=subject.pk).update(
+                queue_size=models.F('queue_size') + 1)
+            ResourceVersion.objects.bump((ResourceVersion.QUEUE, subject.pk))
+            ChangeLog.objects.record([(self.model, pk), (Subject, subject.pk)])
+        return self.model(pk=pk, user=user, subject=subject,
+                          timestamp=timestamp)
+
+    def persons(self, subject):
+        """
+        Получить участников очереди одним запросом с JOIN пользователей,
+        без создания объектов моделей
+        :param subject: предмет
+        :return: список кортежей (время, username, имя, фамилия) в порядке
+        очереди
+        """
+        return self.filter(subject=subject).values_list(
+            'timestamp', 'user__username', 'user__first_name',
+            'user__last_name')
+
+    def position(self, subject, user):
+        """
+        Получить место пользователя и длину очереди одним оконным запросом
+        по индексу (subject, timestamp, id)
+        :param subject: предмет
+        :param user: пользователь
+        :return: (место в очереди или None, длина очереди)
+        """
+        qn = connection.ops.quote_name
+        sql = (
+            f'SELECT COUNT(*), MAX(CASE WHEN {qn("user_id")} = %s '
+            f'THEN {qn("place")} END) FROM ('
+            f'SELECT {qn("user_id")}, ROW_NUMBER() OVER ('
+            f'ORDER BY {qn("timestamp")}, {qn("id")}) AS {qn("place")} '
+            f'FROM {qn(self.model._meta.db_table)} '
+            f'WHERE {qn("subject_id")} = %s) ranked'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, subject.pk])
+            length, place = cursor.fetchone()
+        return place, length
+
+    def positions(self, user):
+        """
+        Получить места пользователя во всех очередях одним оконным запросом
+        :param user: пользователь
+        :return: словарь {id предмета: место в очереди}
+        """
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        sql = (
+            f'SELECT {qn("subject_id")}, {qn("place")} FROM ('
+            f'SELECT {qn("subject_id")}, {qn("user_id")}, ROW_NUMBER() OVER ('
+            f'PARTITION BY {qn("subject_id")} '
+            f'ORDER BY {qn("timestamp")}, {qn("id")}) AS {qn("place")} '
+            f'FROM {table} WHERE {qn("subject_id")} IN ('
+            f'SELECT {qn("subject_id")} FROM {table} '
+            f'WHERE {qn("user_id")} = %s)) ranked '
+            f'WHERE {qn("user_id")} = %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, user.pk])
+            return dict(cursor.fetchall())
+
+
 class Queue(models.Model):
     """
     Модель очереди
@@ -37,12 +143,42 @@ class Queue(models.Model):
         auto_now=True
     )
 
+    objects = QueueManager()
+
     class Meta:
-        ordering = ('id', 'timestamp')
+        ordering = ('timestamp', 'id')
         constraints = [
             models.UniqueConstraint(fields=['subject', 'user'],
                                     name='unique_fields'),
         ]
+        indexes = [
+            models.Index(fields=['subject', 'timestamp', 'id'],
+                         name='queue_subject_order_idx'),
+        ]
+
+
+class PollQuerySet(models.QuerySet):
+    """
+    Набор опросов
+    """
+
+    def with_choices(self):
+        """
+        Загрузить варианты с итогами голосования одним запросом
+        :return: набор опросов
+        """
+        return self.prefetch_related(models.Prefetch(
+            'choices', queryset=Choice.objects.with_totals()))
+
+    def with_user_votes(self, user):
+        """
+        Загрузить голоса пользователя одним запросом в атрибут user_votes
+        :param user: пользователь
+        :return: набор опросов
+        """
+        return self.prefetch_related(models.Prefetch(
+            'vote_set', queryset=Vote.objects.filter(user_id=user.pk),
+            to_attr='user_votes'))
 
 
 class Poll(models.Model):
@@ -50,6 +186,31 @@ class Poll(models.Model):
     Модель опроса
     """
     title = models.CharField(max_length=200)
+    multiple_choice = models.BooleanField(default=False)
+    sharded_votes = models.BooleanField(default=False)
+
+    objects = PollQuerySet.as_manager()
+
+
+class ChoiceQuerySet(models.QuerySet):
+    """
+    Набор вариантов в опросах
+    """
+
+    def with_totals(self):
+        """
+        Добавить итоговое число голосов с учетом шардов счетчика
+        :return: набор вариантов с аннотацией total_votes
+        """
+        shard_votes = ChoiceVoteShard.objects.filter(
+            choice=models.OuterRef('pk')
+        ).order_by().values('choice').annotate(
+            total=models.Sum('votes')
+        ).values('total')
+        return self.annotate(
+            total_votes=models.F('votes') + Coalesce(
+                models.Subquery(shard_votes), models.Value(0))
+        )
 
 
 class Choice(models.Model):
@@ -60,7 +221,63 @@ class Choice(models.Model):
         Poll, related_name='choices', on_delete=models.CASCADE)
     text = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
-    voters = models.ManyToManyField(User, blank=True)
+    voters = models.ManyToManyField(User, blank=True, through='Vote')
+
+    objects = ChoiceQuerySet.as_manager()
+
+    @property
+    def vote_total(self):
+        """
+        Итоговое число голосов: счетчик варианта и сумма его шардов
+        """
+        total = getattr(self, 'total_votes', None)
+        if total is not None:
+            return total
+        if self.pk is None or not self.poll.sharded_votes:
+            return self.votes
+        shard_votes = self.vote_shards.aggregate(
+            total=models.Sum('votes'))['total']
+        return self.votes + (shard_votes or 0)
+
+
+class Vote(models.Model):
+    """
+    Модель голоса пользователя в опросе. Для опросов без multiple_choice
+    уникальный индекс (poll, user) не дает проголосовать дважды.
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    is_multiple = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'user'],
+                                    name='unique_choice_vote'),
+            models.UniqueConstraint(fields=['poll', 'user'],
+                                    condition=models.Q(is_multiple=False),
+                                    name='unique_poll_vote'),
+        ]
+        indexes = [
+            models.Index(fields=['poll', 'user'], name='vote_poll_user_idx'),
+        ]
+
+
+class ChoiceVoteShard(models.Model):
+    """
+    Шард счетчика голосов варианта. Используется для опросов с включенным
+    sharded_votes, чтобы одновременные голоса не блокировали одну строку.
+    """
+    choice = models.ForeignKey(
+        Choice, related_name='vote_shards', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'],
+                                    name='unique_choice_shard'),
+        ]
 
 
 class Attendance(models.Model):
@@ -73,3 +290,195 @@ class Attendance(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(32)]
     )
     is_present = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subject', 'student', 'lesson_serial_number'],
+                name='unique_attendance'),
+        ]
+
+
+class AttendanceMask(models.Model):
+    """
+    Маски посещаемости: одна строка на (предмет, студент).
+    Бит n - 1 соответствует занятию с порядковым номером n. По умолчанию
+    это кеш матрицы, источник данных - построчные отметки Attendance, маски
+    обновляются в той же транзакции, что и отметки. При
+    ATTENDANCE_BITSET_STORAGE строк Attendance нет и маски - единственное
+    хранилище отметок.
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    student = models.ForeignKey(User, on_delete=models.CASCADE)
+    present_mask = models.BigIntegerField(default=0)
+    recorded_mask = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'student'],
+                                    name='unique_attendance_mask'),
+        ]
+
+
+class AttendanceStudentStats(models.Model):
+    """
+    Сводная посещаемость студента по предмету
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    student = models.ForeignKey(User, on_delete=models.CASCADE)
+    present = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'student'],
+                                    name='unique_attendance_student_stats'),
+        ]
+
+
+class AttendanceLessonStats(models.Model):
+    """
+    Сводная посещаемость занятия по предмету
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    lesson_serial_number = models.PositiveSmallIntegerField()
+    present = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'lesson_serial_number'],
+                                    name='unique_attendance_lesson_stats'),
+        ]
+
+
+class ResourceVersionManager(models.Manager):
+    """
+    Менеджер версий ресурсов
+    """
+
+    def bump(self, *keys):
+        """
+        Увеличить версии ресурсов одним запросом. Вызывается в той же
+        транзакции, что и изменение данных, чтобы новая версия стала видна
+        вместе с ними.
+        :param keys: пары (ресурс, область), область - id объекта или 0
+        :return: None
+        """
+        bulk_increment_or_create(
+            self.model, ['resource', 'scope'], ['version'],
+            [(key, (1,)) for key in dict.fromkeys(keys)])
+
+    def stamp(self, *keys):
+        """
+        Получить текущие версии ресурсов одним запросом
+        :param keys: пары (ресурс, область); область None означает все
+        области ресурса, область может быть и выражением подзапроса
+        :return: список кортежей (ресурс, область, версия)
+        """
+        if not keys:
+            return []
+        condition = models.Q()
+        for resource, scope in keys:
+            condition |= models.Q(resource=resource) if scope is None else \
+                models.Q(resource=resource, scope=scope)
+        return list(self.filter(condition).order_by(
+            'resource', 'scope').values_list('resource', 'scope', 'version'))
+
+
+class ResourceVersion(models.Model):
+    """
+    Счетчик изменений ресурса для условных GET запросов (ETag). Область
+    scope - id предмета для данных предмета, id пользователя для версии
+    отдельного пользователя или 0 для ресурса целиком.
+    """
+    resource = models.CharField(max_length=32)
+    scope = models.BigIntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+
+    SUBJECTS = 'subjects'
+    QUEUE = 'queue'
+    POLLS = 'polls'
+    ATTENDANCE = 'attendance'
+    USERS = 'users'
+
+    objects = ResourceVersionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['resource', 'scope'],
+                                    name='unique_resource_version'),
+        ]
+
+
+class ChangeLogManager(models.Manager):
+    """
+    Менеджер журнала изменений
+    """
+
+    def record(self, objects, action=None):
+        """
+        Добавить записи в журнал одним запросом. Вызывается в той же
+        транзакции, что и изменение данных.
+        :param objects: пары (класс модели, id объекта)
+        :param action: DELETE или UPSERT (по умолчанию)
+        :return: None
+        """
+        self.bulk_create(
+            self.model(model=model._meta.model_name, object_id=object_id,
+                       action=action or self.model.UPSERT)
+            for model, object_id in dict.fromkeys(objects)
+        )
+
+    def horizon(self):
+        """
+        Получить номер записи, до которого журнал сжат с потерей удалений.
+        Клиенту с более старым курсором нужна полная синхронизация.
+        :return: номер записи или 0
+        """
+        return ChangeLogHorizon.objects.values_list(
+            'seq', flat=True).first() or 0
+
+    def set_horizon(self, seq):
+        """
+        Запомнить, что записи журнала до seq включительно сжаты с потерей
+        удалений
+        :param seq: номер записи
+        :return: None
+        """
+        ChangeLogHorizon.objects.update_or_create(
+            pk=ChangeLogHorizon.SINGLETON_ID,
+            defaults={'seq': max(seq, self.horizon())})
+
+
+class ChangeLog(models.Model):
+    """
+    Журнал изменений для синхронизации клиентов. Записи только
+    добавляются, id служит монотонным курсором.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTIONS = ((UPSERT, 'Создание или изменение'), (DELETE, 'Удаление'))
+
+    model = models.CharField(max_length=16)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeLogManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'id'],
+                         name='changelog_object_idx'),
+        ]
+
+
+class ChangeLogHorizon(models.Model):
+    """
+    Горизонт сжатия журнала изменений: записи до seq включительно сжаты
+    с потерей удалений. Таблица содержит одну строку.
+    """
+    SINGLETON_ID = 1
+
+    seq = models.BigIntegerField(default=0)
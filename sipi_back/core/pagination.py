@@ -0,0 +1,35 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по индексированному полю, которую клиент включает
+    параметром cursor или page_size. Без этих параметров список
+    возвращается целиком, как раньше. Поле сортировки задает атрибут
+    представления cursor_ordering (по умолчанию id).
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def is_requested(self, request):
+        """
+        Проверить, запросил ли клиент постраничный ответ
+        :param request: Объект запроса
+        :return: bool
+        """
+        return self.cursor_query_param in request.query_params or \
+            self.page_size_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Разбить набор на страницы, если клиент этого запросил
+        :param queryset: набор объектов
+        :param request: Объект запроса
+        :param view: представление
+        :return: список объектов страницы или None без пагинации
+        """
+        if not self.is_requested(request):
+            return None
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return super().paginate_queryset(queryset, request, view)
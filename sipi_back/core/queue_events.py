@@ -0,0 +1,208 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.fields import DateTimeField
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+
+from core.authentication import CachedJWTAuthentication, StreamToken
+from core.models import Queue, Subject
+from sipi_back.events import get_broker
+
+EVENTS_PATH = '/api/queue/events/'
+
+# Комментарий SSE, не дающий прокси закрыть простаивающее соединение
+HEARTBEAT_SECONDS = 15
+
+# Периодическая пересылка снимка на случай потерянных сообщений
+SNAPSHOT_SECONDS = 300
+
+
+def channel(subject_id):
+    """
+    Получить имя канала событий очереди предмета
+    :param subject_id: id предмета
+    :return: имя канала
+    """
+    return f'queue:{subject_id}'
+
+
+def queue_state(subject):
+    """
+    Получить состояние очереди предмета, как в /api/queue/filtered/
+    :param subject: предмет
+    :return: словарь с is_open, subject_name и queue_persons
+    """
+    timestamp_field = DateTimeField()
+    queue_persons = [
+        {
+            'position': position,
+            'subject': subject.slug,
+            'timestamp': timestamp_field.to_representation(timestamp),
+            'subject_name': subject.title,
+            'user_fullname': '{} {}'.format(first_name, last_name),
+            'username': username,
+        }
+        for position, (timestamp, username, first_name, last_name)
+        in enumerate(Queue.objects.persons(subject), start=1)
+    ]
+    return {"is_open": subject.is_open, "subject_name": subject.title,
+            "queue_persons": queue_persons}
+
+
+def publish(subject_id, message):
+    """
+    Отправить событие очереди подписчикам после фиксации транзакции
+    :param subject_id: id предмета
+    :param message: словарь события с ключом type
+    :return: None
+    """
+    transaction.on_commit(
+        lambda: get_broker().publish(channel(subject_id), message))
+
+
+def publish_join(queue):
+    """
+    Сообщить о новом участнике очереди
+    :param queue: объект очереди
+    :return: None
+    """
+    publish(queue.subject_id, {
+        'type': 'join',
+        'username': queue.user.username,
+        'user_fullname': '{} {}'.format(queue.user.first_name,
+                                        queue.user.last_name),
+        'timestamp': DateTimeField().to_representation(queue.timestamp),
+    })
+
+
+def publish_leave(queue):
+    """
+    Сообщить о выходе из очереди
+    :param queue: объект очереди
+    :return: None
+    """
+    publish(queue.subject_id, {
+        'type': 'leave',
+        'username': queue.user.username,
+    })
+
+
+def publish_access(subject):
+    """
+    Сообщить об открытии или закрытии очереди
+    :param subject: предмет
+    :return: None
+    """
+    publish(subject.pk, {'type': 'access', 'is_open': subject.is_open})
+
+
+def event(event_type, data):
+    """
+    Сформировать сообщение Server-Sent Events
+    :return: байты
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f'event: {event_type}\ndata: {payload}\n\n'.encode()
+
+
+def authorize(token, slug):
+    """
+    Проверить токен и найти предмет
+    :param token: токен потока событий, см. StreamToken
+    :param slug: slug предмета
+    :return: (код ошибки, предмет)
+    """
+    close_old_connections()
+    try:
+        CachedJWTAuthentication().get_user(StreamToken(token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return 401, None
+    subject = Subject.objects.filter(slug=slug).first()
+    return (404, None) if subject is None else (200, subject)
+
+
+def snapshot(subject):
+    """
+    Получить свежее состояние очереди предмета
+    :param subject: предмет
+    :return: словарь состояния
+    """
+    close_old_connections()
+    subject.refresh_from_db()
+    return queue_state(subject)
+
+
+async def send_error(send, status_code, message):
+    await send({'type': 'http.response.start', 'status': status_code,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps({'error': message}).encode()})
+
+
+async def queue_events(scope, receive, send):
+    """
+    ASGI приложение потока событий очереди предмета (Server-Sent Events):
+    GET /api/queue/events/?subject=<slug>&token=<токен потока>.
+    Токен выдает /api/queue/stream-token/, access токен не принимается:
+    строка запроса попадает в журналы прокси. Сначала отправляется
+    снимок очереди (snapshot), затем изменения: join, leave и access.
+    """
+    params = parse_qs(scope['query_string'].decode())
+    slug = params.get('subject', [''])[0]
+    token = params.get('token', [''])[0]
+    if not slug or not token:
+        await send_error(send, 400, 'subject and token params are required')
+        return
+    status_code, subject = await sync_to_async(authorize)(token, slug)
+    if subject is None:
+        await send_error(send, status_code, 'Unauthorized'
+                         if status_code == 401 else 'Not found')
+        return
+
+    subscription = get_broker().subscribe(channel(subject.pk))
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    message = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        loop = asyncio.get_running_loop()
+        snapshot_at = None
+        while True:
+            if subscription.lost or snapshot_at is None or \
+                    loop.time() - snapshot_at > SNAPSHOT_SECONDS:
+                subscription.lost = False
+                state = await sync_to_async(snapshot)(subject)
+                await send({'type': 'http.response.body',
+                            'body': event('snapshot', state),
+                            'more_body': True})
+                snapshot_at = loop.time()
+            if message is None:
+                message = asyncio.ensure_future(subscription.queue.get())
+            await asyncio.wait({message, disconnect},
+                               timeout=HEARTBEAT_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                break
+            if message.done():
+                body = event(message.result()['type'], message.result())
+                message = None
+            else:
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': True})
+    finally:
+        subscription.close()
+        disconnect.cancel()
+        if message is not None:
+            message.cancel()
@@ -1,29 +1,39 @@
 import random
 import string
+from collections import Counter
 
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.validators import UniqueTogetherValidator
-
-from core.models import Subject, Queue, Poll, Choice, Attendance
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator, \
+    UniqueValidator
+
+from core import attendance as attendance_data
+from core.db import increment_or_create
+from core.users_import import hash_passwords
+from core.models import Subject, Queue, Poll, Choice, ChoiceVoteShard, \
+    Vote, Attendance, ResourceVersion, ChangeLog
 from users.models import User
 
 PASSWORD_LENGTH = 12
 
 QUEUE_ERROR_MESSAGE = "You are already in queue on this subject"
 
+QUEUE_CLOSED_ERROR_MESSAGE = "Cannot add to queue for a closed subject."
+
 
 class SubjectSerializer(serializers.ModelSerializer):
     """
     Сериализатор предметов
     """
     queue_is_open = serializers.BooleanField(source='is_open', read_only=True)
-    count_in_queue = serializers.SerializerMethodField(read_only=True)
-
-    @staticmethod
-    def get_count_in_queue(subject) -> int:
-        return Queue.objects.filter(subject=subject).count()
+    count_in_queue = serializers.IntegerField(source='queue_size',
+                                              read_only=True)
 
     class Meta:
         fields = ('id', 'title', 'slug', 'queue_is_open', 'count_in_queue')
@@ -31,6 +41,15 @@ class SubjectSerializer(serializers.ModelSerializer):
         read_only_fields = ('slug', 'queue_is_open', 'count_in_queue')
 
 
+def generate_password():
+    """
+    Сгенерировать случайный пароль пользователя
+    :return: пароль
+    """
+    return ''.join(random.choices(string.ascii_letters + string.digits,
+                                  k=PASSWORD_LENGTH))
+
+
 class UsersCreateSerializer(serializers.ModelSerializer):
     """
     Сериализатор создания пользователя
@@ -52,15 +71,100 @@ class UsersCreateSerializer(serializers.ModelSerializer):
         :param validated_data: данные опроса для создания объекта в базе данных
         :return: объект пользователя
         """
-        password = ''.join(
-            random.choices(string.ascii_letters + string.digits,
-                           k=PASSWORD_LENGTH))
+        password = generate_password()
         validated_data['password'] = make_password(password)
         user = super().create(validated_data)
         user.password = password
         return user
 
 
+class UsersImportRowSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор строки массового импорта пользователей. Уникальность
+    проверяется для всего импорта сразу в UsersImportSerializer.
+    """
+    first_name = serializers.CharField(required=True)
+    last_name = serializers.CharField(required=True)
+
+    class Meta:
+        model = User
+        fields = ['username', 'first_name', 'last_name', 'personal_cipher',
+                  'role']
+
+    def get_fields(self):
+        """
+        Убрать из полей только проверку уникальности, остальные проверки
+        модели, например допустимые символы username, остаются
+        :return: словарь полей
+        """
+        fields = super().get_fields()
+        for field in fields.values():
+            field.validators = [validator for validator in field.validators
+                                if not isinstance(validator, UniqueValidator)]
+        return fields
+
+
+class UsersImportSerializer(serializers.Serializer):
+    """
+    Сериализатор массового импорта пользователей
+    """
+    users = UsersImportRowSerializer(many=True, allow_empty=False)
+
+    @staticmethod
+    def validate_users(users):
+        """
+        Проверить уникальность username и personal_cipher внутри импорта
+        и в базе данных одним запросом
+        :param users: список данных пользователей
+        :return: список данных пользователей
+        """
+        errors = []
+        for field in ('username', 'personal_cipher'):
+            counts = Counter(user[field] for user in users)
+            duplicates = sorted(value for value, count in counts.items()
+                                if count > 1)
+            if duplicates:
+                errors.append(f'Duplicate {field} in import: {duplicates}')
+        existing = User.objects.filter(
+            Q(username__in=[user['username'] for user in users]) |
+            Q(personal_cipher__in=[user['personal_cipher'] for user in users])
+        ).values_list('username', 'personal_cipher')
+        usernames = {user['username'] for user in users}
+        ciphers = {user['personal_cipher'] for user in users}
+        taken_usernames = sorted({username for username, _ in existing
+                                  if username in usernames})
+        taken_ciphers = sorted({cipher for _, cipher in existing
+                                if cipher in ciphers})
+        if taken_usernames:
+            errors.append(f'username already exists: {taken_usernames}')
+        if taken_ciphers:
+            errors.append(
+                f'personal_cipher already exists: {taken_ciphers}')
+        if errors:
+            raise ValidationError(errors)
+        return users
+
+    def create(self, validated_data):
+        """
+        Создать пользователей одним запросом, хешируя пароли в пуле
+        процессов
+        :param validated_data: данные пользователей
+        :return: список созданных пользователей с открытыми паролями
+        """
+        rows = validated_data['users']
+        passwords = [generate_password() for _ in rows]
+        users = [
+            User(password=hashed, **row)
+            for row, hashed in zip(rows, hash_passwords(passwords))
+        ]
+        User.objects.bulk_create(users)
+        # bulk_create не отправляет сигналы модели
+        ResourceVersion.objects.bump((ResourceVersion.USERS, 0))
+        for user, password in zip(users, passwords):
+            user.password = password
+        return users
+
+
 class UsersSerializer(serializers.ModelSerializer):
     """
     Сериализатор пользователей
@@ -110,33 +214,101 @@ class QueueSerializer(serializers.ModelSerializer):
                   'user_fullname', 'username')
         read_only_fields = (
             'user', 'timestamp', 'subject', 'subject_name', 'user_fullname')
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Queue.objects.all(),
-                fields=['user', 'subject'],
-                message=QUEUE_ERROR_MESSAGE
-            )
-        ]
+        # Уникальность проверяется самой вставкой в Queue.objects.join
+        validators = []
+
+    def create(self, validated_data):
+        """
+        Встать в очередь
+        :param validated_data: данные для добавления в очередь
+        :return: объект очереди
+        """
+        user = validated_data['user']
+        subject = validated_data['subject']
+        timestamp = validated_data.get('timestamp') or timezone.now()
+        queue = Queue.objects.join(user, subject, timestamp)
+        if queue is not None:
+            return queue
+        if Queue.objects.filter(subject=subject, user=user).exists():
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [QUEUE_ERROR_MESSAGE]})
+        raise ValidationError(QUEUE_CLOSED_ERROR_MESSAGE)
 
 
 class ChoiceSerializer(serializers.ModelSerializer):
     """
     Сериализатор выбора в опросе
     """
+    votes = serializers.IntegerField(source='vote_total', read_only=True)
+
     class Meta:
         model = Choice
         fields = ('id', 'text', 'votes')
 
 
+class ChoiceSyncSerializer(ChoiceSerializer):
+    """
+    Сериализатор варианта для синхронизации: с id опроса
+    """
+
+    class Meta(ChoiceSerializer.Meta):
+        fields = ('id', 'poll', 'text', 'votes')
+
+
+class PollSyncSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор опроса для синхронизации: без вариантов, они
+    синхронизируются отдельно
+    """
+
+    class Meta:
+        model = Poll
+        fields = ('id', 'title', 'multiple_choice', 'sharded_votes')
+
+
 class PollSerializer(serializers.ModelSerializer):
     """
     Сериализатор опросов
     """
     choices = ChoiceSerializer(many=True, read_only=False)
+    voted = serializers.SerializerMethodField()
+    user_choices = serializers.SerializerMethodField()
 
     class Meta:
         model = Poll
-        fields = ('id', 'title', 'choices')
+        fields = ('id', 'title', 'multiple_choice', 'sharded_votes',
+                  'choices', 'voted', 'user_choices')
+
+    def user_votes(self, poll):
+        """
+        Получить голоса текущего пользователя в опросе. Во вьюсете они
+        загружаются одним запросом для всех опросов в атрибут user_votes.
+        :param poll: объект опроса
+        :return: список голосов пользователя
+        """
+        votes = getattr(poll, 'user_votes', None)
+        if votes is None:
+            request = self.context.get('request')
+            user_id = request.user.pk if request else None
+            votes = list(poll.vote_set.filter(user_id=user_id))
+            poll.user_votes = votes
+        return votes
+
+    def get_voted(self, poll) -> bool:
+        """
+        Проголосовал ли текущий пользователь в опросе
+        :param poll: объект опроса
+        :return: True, если пользователь уже голосовал
+        """
+        return bool(self.user_votes(poll))
+
+    def get_user_choices(self, poll) -> list:
+        """
+        Получить варианты, выбранные текущим пользователем
+        :param poll: объект опроса
+        :return: список id вариантов
+        """
+        return [vote.choice_id for vote in self.user_votes(poll)]
 
     def create(self, validated_data):
         """
@@ -145,18 +317,76 @@ class PollSerializer(serializers.ModelSerializer):
         :return: объект опроса
         """
         choices_data = validated_data.pop('choices')
-        poll = Poll.objects.create(**validated_data)
-        for choice_data in choices_data:
-            Choice.objects.create(poll=poll, **choice_data)
+        with transaction.atomic():
+            poll = Poll.objects.create(**validated_data)
+            choices = Choice.objects.bulk_create(
+                Choice(poll=poll, **choice_data)
+                for choice_data in choices_data
+            )
+            # bulk_create не отправляет сигналы модели
+            ChangeLog.objects.record(
+                (Choice, choice.pk) for choice in choices)
+        poll.user_votes = []
         return poll
 
 
+class ChoiceResultSerializer(serializers.Serializer):
+    """
+    Сериализатор результатов по варианту опроса
+    """
+    id = serializers.IntegerField()
+    text = serializers.CharField()
+    votes = serializers.IntegerField(source='vote_total')
+    percent = serializers.SerializerMethodField()
+
+    def get_percent(self, choice) -> float:
+        """
+        Получить долю голосов за вариант
+        :param choice: объект варианта
+        :return: процент голосов, округленный до десятых
+        """
+        total = self.context.get('poll_totals', {}).get(choice.poll_id)
+        if not total:
+            return 0.0
+        return round(choice.vote_total * 100 / total, 1)
+
+
+class PollResultsSerializer(serializers.Serializer):
+    """
+    Облегченный сериализатор результатов опроса
+    """
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    total_votes = serializers.SerializerMethodField()
+    choices = ChoiceResultSerializer(many=True)
+
+    def to_representation(self, poll):
+        """
+        Посчитать итог голосов опроса до сериализации вариантов, чтобы
+        вычислить проценты без дополнительных запросов
+        :param poll: объект опроса
+        :return: словарь с результатами опроса
+        """
+        totals = self.context.setdefault('poll_totals', {})
+        totals[poll.pk] = sum(
+            choice.vote_total for choice in poll.choices.all())
+        return super().to_representation(poll)
+
+    def get_total_votes(self, poll) -> int:
+        """
+        Получить общее число голосов в опросе
+        :param poll: объект опроса
+        :return: число голосов
+        """
+        return self.context['poll_totals'][poll.pk]
+
+
 class VoteSerializer(serializers.ModelSerializer):
     """
     Сериализатор голосования
     """
     id = serializers.PrimaryKeyRelatedField(
-        queryset=Choice.objects.all()
+        queryset=Choice.objects.select_related('poll')
     )
 
     class Meta:
@@ -165,17 +395,36 @@ class VoteSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         """
-        Добавить объект выбора пользователя
+        Добавить объект выбора пользователя. Повторный голос отклоняется
+        ограничениями уникальности модели Vote, счетчик увеличивается
+        атомарно на стороне базы данных.
         :param validated_data:
         :return: объект выбора
         """
         choice = validated_data.get("id")
         user = self.context.get('request').user
-        if choice.voters.filter(id=user.id).exists():
-            raise ValidationError("You have already voted for this choice.")
-        choice.voters.add(user)
-        choice.votes += 1
-        choice.save()
+        try:
+            with transaction.atomic():
+                Vote.objects.create(
+                    poll_id=choice.poll_id, choice_id=choice.pk,
+                    user_id=user.pk,
+                    is_multiple=choice.poll.multiple_choice)
+                if choice.poll.sharded_votes:
+                    increment_or_create(
+                        ChoiceVoteShard,
+                        {'choice_id': choice.pk,
+                         'shard': random.randrange(
+                             settings.VOTE_COUNTER_SHARDS)},
+                        votes=1,
+                    )
+                else:
+                    Choice.objects.filter(pk=choice.pk).update(
+                        votes=F('votes') + 1)
+        except IntegrityError:
+            if Vote.objects.filter(choice=choice, user=user).exists():
+                raise ValidationError(
+                    "You have already voted for this choice.")
+            raise ValidationError("You have already voted in this poll.")
         return choice
 
 
@@ -199,7 +448,175 @@ class AttendanceSerializer(serializers.ModelSerializer):
         """
         return '{} {}'.format(obj.student.first_name, obj.student.last_name)
 
+    def validate(self, attrs):
+        """
+        Проверить уникальность отметки в компактном режиме хранения: строк
+        Attendance там нет, и UniqueTogetherValidator их не найдет
+        :param attrs: проверенные данные отметки
+        :return: проверенные данные отметки
+        """
+        if attendance_data.bitset_storage():
+            subject, student, lesson_serial_number = (
+                attrs.get(name, getattr(self.instance, name, None))
+                for name in ('subject', 'student', 'lesson_serial_number'))
+            key = (subject.pk, student.pk, lesson_serial_number)
+            if self.instance is not None and \
+                    key == attendance_data.mark_of(self.instance)[:3]:
+                return attrs
+            if attendance_data.stored_marks([key]):
+                raise ValidationError(
+                    'The fields subject, student, lesson_serial_number '
+                    'must make a unique set.', code='unique')
+        return attrs
+
     class Meta:
         model = Attendance
         fields = ['subject', 'student', 'lesson_serial_number', 'is_present',
                   'user_fullname']
+        validators = [
+            UniqueTogetherValidator(
+                queryset=Attendance.objects.all(),
+                fields=['subject', 'student', 'lesson_serial_number'],
+            )
+        ]
+
+
+class AttendanceMarkSerializer(serializers.Serializer):
+    """
+    Сериализатор отметки одного студента при массовой отметке посещаемости
+    """
+    student = serializers.IntegerField()
+    is_present = serializers.BooleanField()
+
+
+class AttendanceBulkSerializer(serializers.Serializer):
+    """
+    Сериализатор массовой отметки посещаемости за одно занятие
+    """
+    subject = serializers.SlugRelatedField(slug_field='slug',
+                                           queryset=Subject.objects.all())
+    lesson_serial_number = serializers.IntegerField(min_value=1,
+                                                    max_value=32)
+    students = AttendanceMarkSerializer(many=True, allow_empty=False)
+
+    @staticmethod
+    def validate_students(students):
+        """
+        Проверить список студентов одним запросом
+        :param students: список отметок студентов
+        :return: список отметок студентов
+        """
+        ids = [mark['student'] for mark in students]
+        if len(set(ids)) != len(ids):
+            raise ValidationError('Each student can be marked only once.')
+        existing = set(User.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True))
+        missing = sorted(set(ids) - existing)
+        if missing:
+            raise ValidationError(f'Students not found: {missing}')
+        return students
+
+    def create(self, validated_data):
+        """
+        Создать или обновить отметки всех студентов одним запросом
+        :param validated_data: проверенные данные отметок
+        :return: сводка по отметкам
+        """
+        subject = validated_data['subject']
+        lesson_serial_number = validated_data['lesson_serial_number']
+        students = validated_data['students']
+        rows = [
+            Attendance(subject=subject, student_id=mark['student'],
+                       lesson_serial_number=lesson_serial_number,
+                       is_present=mark['is_present'])
+            for mark in students
+        ]
+        with transaction.atomic():
+            attendance_data.lock_subjects(subject.pk)
+            if attendance_data.bitset_storage():
+                attendance_data.write_marks(
+                    added=[attendance_data.mark_of(row) for row in rows])
+            else:
+                self.save_rows(rows)
+        present = sum(mark['is_present'] for mark in students)
+        return {
+            'subject': subject.slug,
+            'lesson_serial_number': lesson_serial_number,
+            'marked': len(students),
+            'present': present,
+            'absent': len(students) - present,
+        }
+
+    @staticmethod
+    def save_rows(rows):
+        """
+        Создать или обновить построчные отметки одного занятия одним
+        запросом и учесть их в производных данных
+        :param rows: несохраненные объекты Attendance одного занятия
+        :return: None
+        """
+        subject_id = rows[0].subject_id
+        lesson_serial_number = rows[0].lesson_serial_number
+        student_ids = [row.student_id for row in rows]
+        replaced = Attendance.objects.filter(
+            subject_id=subject_id, lesson_serial_number=lesson_serial_number,
+            student_id__in=student_ids)
+        removed = [attendance_data.mark_of(row) for row in replaced]
+        Attendance.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['subject', 'student', 'lesson_serial_number'],
+            update_fields=['is_present'],
+        )
+        attendance_data.apply_changes(
+            added=[attendance_data.mark_of(row) for row in rows],
+            removed=removed)
+        # При update_conflicts id строк не возвращаются
+        ChangeLog.objects.record(
+            (Attendance, pk) for pk in Attendance.objects.filter(
+                subject_id=subject_id,
+                lesson_serial_number=lesson_serial_number,
+                student_id__in=student_ids,
+            ).values_list('pk', flat=True))
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """
+    Сериализатор одного вложенного запроса пакета
+    """
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    path = serializers.RegexField(r'^/api/', max_length=2048)
+    body = serializers.JSONField(required=False, default=None)
+
+    @staticmethod
+    def validate_path(path):
+        """
+        Запретить вложенные пакеты
+        :param path: путь запроса
+        :return: путь запроса
+        """
+        if path.split('?')[0].rstrip('/') == '/api/batch':
+            raise ValidationError('Nested batch requests are not allowed.')
+        return path
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Сериализатор пакета запросов
+    """
+    atomic = serializers.BooleanField(default=False)
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    @staticmethod
+    def validate_requests(requests):
+        """
+        Ограничить размер пакета
+        :param requests: вложенные запросы
+        :return: вложенные запросы
+        """
+        if len(requests) > settings.BATCH_MAX_REQUESTS:
+            raise ValidationError(
+                f'At most {settings.BATCH_MAX_REQUESTS} requests are '
+                f'allowed in a batch.')
+        return requests
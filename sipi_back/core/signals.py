@@ -0,0 +1,140 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+
+from core import attendance as attendance_data
+from core import queue_events
+from core.authentication import user_cache, user_cache_key
+from core.models import Attendance, AttendanceMask, ChangeLog, Choice, \
+    Poll, Queue, ResourceVersion, Subject, Vote
+from users.models import User
+
+
+@receiver(post_save, sender=Queue)
+def increase_queue_size(sender, instance, created, **kwargs):
+    """
+    Увеличить счетчик очереди предмета при добавлении в очередь
+    """
+    if created:
+        Subject.objects.filter(pk=instance.subject_id).update(
+            queue_size=F('queue_size') + 1)
+        ResourceVersion.objects.bump(
+            (ResourceVersion.QUEUE, instance.subject_id))
+        ChangeLog.objects.record([(Subject, instance.subject_id)])
+        queue_events.publish_join(instance)
+
+
+@receiver(post_delete, sender=Queue)
+def decrease_queue_size(sender, instance, **kwargs):
+    """
+    Уменьшить счетчик очереди предмета при выходе из очереди
+    """
+    Subject.objects.filter(pk=instance.subject_id, queue_size__gt=0).update(
+        queue_size=F('queue_size') - 1)
+    ResourceVersion.objects.bump(
+        (ResourceVersion.QUEUE, instance.subject_id))
+    ChangeLog.objects.record([(Subject, instance.subject_id)])
+    queue_events.publish_leave(instance)
+
+
+@receiver(post_save, sender=Queue)
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Poll)
+@receiver(post_save, sender=Choice)
+@receiver(post_save, sender=Attendance)
+def log_saved(sender, instance, **kwargs):
+    """
+    Записать изменение объекта в журнал синхронизации
+    """
+    ChangeLog.objects.record([(sender, instance.pk)])
+
+
+@receiver(post_delete, sender=Queue)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Poll)
+@receiver(post_delete, sender=Choice)
+@receiver(post_delete, sender=Attendance)
+def log_deleted(sender, instance, **kwargs):
+    """
+    Записать удаление объекта в журнал синхронизации
+    """
+    ChangeLog.objects.record([(sender, instance.pk)], ChangeLog.DELETE)
+
+
+@receiver(post_delete, sender=Attendance)
+def discard_attendance(sender, instance, **kwargs):
+    """
+    Учесть удаление отметки в сводной посещаемости и масках, в том числе
+    при каскадном удалении студента или предмета
+    """
+    attendance_data.discard_marks([attendance_data.mark_of(instance)])
+
+
+@receiver(post_delete, sender=AttendanceMask)
+def discard_attendance_mask(sender, instance, **kwargs):
+    """
+    Учесть удаление строки масок в компактном режиме хранения посещаемости:
+    вместе с ней удалены отметки студента по предмету
+    """
+    if attendance_data.bitset_storage():
+        attendance_data.discard_mask(instance)
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def log_vote(sender, instance, **kwargs):
+    """
+    Записать в журнал синхронизации изменение числа голосов варианта
+    """
+    ChangeLog.objects.record([(Choice, instance.choice_id)])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Сбросить пользователя в кеше JWT аутентификации этого процесса при
+    изменении или удалении. Остальные процессы сбрасывают запись по
+    версии пользователя, см. bump_user_version.
+    """
+    user_cache.invalidate(
+        user_cache_key(getattr(instance, api_settings.USER_ID_FIELD)))
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def bump_subject_version(sender, instance, **kwargs):
+    """
+    Сменить версии списка предметов и очереди предмета
+    """
+    ResourceVersion.objects.bump((ResourceVersion.SUBJECTS, 0),
+                                 (ResourceVersion.QUEUE, instance.pk))
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def bump_poll_version(sender, instance, **kwargs):
+    """
+    Сменить версию опросов при изменении опроса, вариантов или голосов
+    """
+    ResourceVersion.objects.bump((ResourceVersion.POLLS, 0))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_version(sender, instance, update_fields=None, **kwargs):
+    """
+    Сменить версии списка пользователей и самого пользователя. По версии
+    пользователя процессы сбрасывают его в кеше JWT аутентификации.
+    Обновление last_login при входе не меняет отдаваемых данных и прав,
+    версии не трогает.
+    """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    ResourceVersion.objects.bump((ResourceVersion.USERS, 0),
+                                 (ResourceVersion.USERS, instance.pk))
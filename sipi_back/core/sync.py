@@ -0,0 +1,141 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core import attendance as attendance_data
+from core.models import Attendance, ChangeLog, Choice, Poll, Queue, Subject
+from core.serializers import AttendanceSerializer, ChoiceSyncSerializer, \
+    PollSyncSerializer, QueueSerializer, SubjectSerializer
+
+# Модели журнала изменений: набор для загрузки текущих строк и сериализатор
+SYNC_MODELS = {
+    'subject': (Subject.objects.all(), SubjectSerializer),
+    'queue': (Queue.objects.select_related('user', 'subject'),
+              QueueSerializer),
+    'poll': (Poll.objects.all(), PollSyncSerializer),
+    'choice': (Choice.objects.with_totals(), ChoiceSyncSerializer),
+    'attendance': (Attendance.objects.select_related('subject', 'student'),
+                   AttendanceSerializer),
+}
+
+
+def load(model, queryset, pks):
+    """
+    Загрузить текущие объекты модели журнала по id. Отметки посещаемости
+    в компактном режиме собираются из масок.
+    :param model: имя модели журнала
+    :param queryset: набор для загрузки строк
+    :param pks: id объектов
+    :return: словарь {id: объект}
+    """
+    if model == 'attendance' and attendance_data.bitset_storage():
+        return attendance_data.attendance_in_bulk(pks)
+    return queryset.in_bulk(pks)
+
+
+def settled_before():
+    """
+    Время, раньше которого записи журнала считаются зафиксированными.
+    Номера записей выдаются при вставке, а видны они после фиксации
+    транзакции, поэтому курсор не сдвигается за свежие записи: клиент
+    получит их еще раз, но не пропустит медленную транзакцию с меньшим
+    номером.
+    :return: datetime
+    """
+    return timezone.now() - datetime.timedelta(
+        seconds=settings.CHANGELOG_SETTLE_SECONDS)
+
+
+def reset():
+    """
+    Ответ клиенту, курсор которого старше сжатой части журнала: клиент
+    загружает списки заново и продолжает с полученного курсора
+    :return: словарь ответа
+    """
+    cursor = ChangeLog.objects.filter(
+        timestamp__lte=settled_before()).aggregate(cursor=Max('id'))['cursor']
+    return {'reset': True, 'cursor': max(cursor or 0,
+                                         ChangeLog.objects.horizon()),
+            'has_more': False, 'changes': []}
+
+
+def changes(since, limit):
+    """
+    Получить изменения после курсора. Для каждого объекта возвращается
+    только последнее изменение с текущими данными строки.
+    :param since: курсор, номер последней полученной записи журнала
+    :param limit: максимальное число записей журнала в ответе
+    :return: словарь с cursor, has_more, reset и changes
+    """
+    if since < ChangeLog.objects.horizon():
+        return reset()
+    entries = list(ChangeLog.objects.filter(id__gt=since).order_by('id')[
+        :limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.model, entry.object_id), None)
+        latest[(entry.model, entry.object_id)] = entry
+
+    rows = {}
+    for model, (queryset, serializer_class) in SYNC_MODELS.items():
+        pks = [object_id for (name, object_id), entry in latest.items()
+               if name == model and entry.action == ChangeLog.UPSERT]
+        if pks:
+            rows[model] = (load(model, queryset, pks), serializer_class)
+
+    result = []
+    for (model, object_id), entry in latest.items():
+        objects, serializer_class = rows.get(model, ({}, None))
+        # Объект мог быть удален позже записи: тогда отдается удаление
+        instance = objects.get(object_id)
+        result.append({
+            'seq': entry.id,
+            'model': model,
+            'id': object_id,
+            'action': entry.action if instance is not None
+            else ChangeLog.DELETE,
+            'data': serializer_class(instance).data
+            if instance is not None else None,
+        })
+
+    # Курсор не сдвигается за незафиксированные записи и при полной
+    # странице, а незафиксированный хвост клиент запросит позже
+    cursor = since
+    settled = settled_before()
+    for entry in entries:
+        if entry.timestamp > settled:
+            has_more = False
+            break
+        cursor = entry.id
+    return {'reset': False, 'cursor': cursor, 'has_more': has_more,
+            'changes': result}
+
+
+def compact(retention_days):
+    """
+    Сжать журнал: оставить по одной последней записи на объект и удалить
+    записи об удалении старше срока хранения. Клиенты с курсором до
+    удаленных записей получат reset.
+    :param retention_days: срок хранения записей об удалении в днях
+    :return: (удалено повторных записей, удалено записей об удалении)
+    """
+    latest = ChangeLog.objects.values('model', 'object_id').annotate(
+        last=Max('id')).values('last')
+    superseded, _ = ChangeLog.objects.exclude(id__in=latest).delete()
+
+    expired = ChangeLog.objects.filter(
+        action=ChangeLog.DELETE,
+        timestamp__lt=timezone.now() - datetime.timedelta(days=retention_days))
+    horizon = expired.aggregate(horizon=Max('id'))['horizon']
+    if horizon is None:
+        return superseded, 0
+    with transaction.atomic():
+        deleted, _ = expired.filter(id__lte=horizon).delete()
+        ChangeLog.objects.set_horizon(horizon)
+    return superseded, deleted
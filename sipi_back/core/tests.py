@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from core.models import Attendance, Subject
+from core.views import SubjectViewSet
+from sipi_back.queries import QueryBudgetExceeded
+from users.models import User
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(APITestCase):
+    """
+    Проверка query_budget представлений в строгом режиме
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='student', password='password', personal_cipher='s1',
+            first_name='Student', last_name='Test')
+        self.client.force_authenticate(user)
+        Subject.objects.create(title='Math')
+
+    def test_within_budget(self):
+        response = self.client.get('/api/subjects/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(SubjectViewSet, 'query_budget', {'list': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/subjects/')
+
+
+class AttendanceStorageTests(APITestCase):
+    """
+    Отметки посещаемости в построчном и компактном режимах хранения
+    """
+
+    def setUp(self):
+        moderator = User.objects.create_user(
+            username='moderator', password='password', personal_cipher='m1',
+            first_name='Moderator', last_name='Test', role=2)
+        self.students = [
+            User.objects.create_user(
+                username=f'student{i}', password='password',
+                personal_cipher=f's{i}', first_name='Student',
+                last_name=str(i))
+            for i in range(2)
+        ]
+        self.client.force_authenticate(moderator)
+        Subject.objects.create(title='Math')
+
+    def mark_and_edit(self):
+        """
+        Отметить занятия, изменить и удалить отметку через API
+        :return: (матрица, статистика) предмета
+        """
+        for lesson in (1, 32):
+            self.client.post('/api/attendance/bulk/', {
+                'subject': 'math', 'lesson_serial_number': lesson,
+                'students': [{'student': student.pk, 'is_present': bool(i)}
+                             for i, student in enumerate(self.students)],
+            }, format='json')
+        mark = {'subject': 'math', 'student': self.students[0].pk,
+                'lesson_serial_number': 5, 'is_present': True}
+        response = self.client.post('/api/attendance/', mark, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/attendance/', mark, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        ids = {
+            (change['data']['student'],
+             change['data']['lesson_serial_number']): change['id']
+            for change in self.client.get('/api/sync/?since=0').json()[
+                'changes']
+            if change['model'] == 'attendance' and change['data']
+        }
+        pk = ids[self.students[0].pk, 5]
+        response = self.client.put(f'/api/attendance/{pk}/', {
+            **mark, 'lesson_serial_number': 6, 'is_present': False,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        pk = ids[self.students[1].pk, 1]
+        response = self.client.delete(f'/api/attendance/{pk}/')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(f'/api/attendance/{pk}/?subject=math')
+        self.assertEqual(response.status_code, 404)
+        return (self.client.get('/api/attendance/matrix/?subject=math').json(),
+                self.client.get('/api/attendance/stats/?subject=math').json())
+
+    def test_rows(self):
+        matrix, stats = self.mark_and_edit()
+        self.assertEqual(Attendance.objects.count(), 4)
+        self.assertEqual(matrix['students'][0]['recorded_mask'],
+                         1 | 1 << 5 | 1 << 31)
+        self.assertEqual(stats['students'][1]['total'], 1)
+
+    @override_settings(ATTENDANCE_BITSET_STORAGE=True)
+    def test_bitset(self):
+        matrix, stats = self.mark_and_edit()
+        self.assertEqual(Attendance.objects.count(), 0)
+        self.assertEqual(matrix['students'][0]['recorded_mask'],
+                         1 | 1 << 5 | 1 << 31)
+        self.assertEqual(stats['students'][1]['total'], 1)
@@ -1,12 +1,16 @@
+from django.conf import settings
 from django.urls import include, path, re_path
 
 from rest_framework.routers import DefaultRouter
 
 from core.views import SubjectViewSet, UsersViewSet, \
     QueueViewSet, PollViewSet, VotePollViewSet, \
-    AttendanceViewSet, UserCreateViewSet
+    AttendanceViewSet, UserCreateViewSet, ExportViewSet, UserImportViewSet, \
+    MetricsViewSet, SlowQueryViewSet, SyncViewSet, DashboardViewSet, \
+    BatchViewSet
 
-from sipi_back.redoc import schema_view
+from sipi_back.openapi import schema_file
+from sipi_back.redoc import docs_view
 
 router = DefaultRouter()
 
@@ -14,6 +18,8 @@ router.register('subjects', SubjectViewSet, basename='subjects')
 
 router.register('users/create', UserCreateViewSet, basename='create_user')
 
+router.register('users/import', UserImportViewSet, basename='import_users')
+
 # router.register('users/me', CurrentUserViewSet, basename='users_me')
 
 router.register('users', UsersViewSet, basename='users')
@@ -26,19 +32,33 @@ router.register('queue', QueueViewSet, basename='queue')
 
 router.register('attendance', AttendanceViewSet, basename='attendance')
 
+router.register('export', ExportViewSet, basename='export')
+
+router.register('dashboard', DashboardViewSet, basename='dashboard')
+
+router.register('sync', SyncViewSet, basename='sync')
+
+router.register('batch', BatchViewSet, basename='batch')
+
+router.register('metrics', MetricsViewSet, basename='metrics')
+
+router.register('slow-queries', SlowQueryViewSet, basename='slow_queries')
+
 
 urlpatterns = [
     path('', include(router.urls)),
 
     # path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
-
-
-    # redoc urls
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$',
-            schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    re_path(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0),
-            name='schema-swagger-ui'),
-    re_path(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0),
-            name='schema-redoc'),
 ]
+
+# redoc urls
+if settings.API_DOCS_ENABLED:
+    urlpatterns += [
+        # Готовая схема с ETag, интерфейсы ниже загружают ее по SPEC_URL
+        re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_file,
+                name='schema-json'),
+        re_path(r'^swagger/$', docs_view('swagger'),
+                name='schema-swagger-ui'),
+        re_path(r'^redoc/$', docs_view('redoc'), name='schema-redoc'),
+    ]
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+CREDENTIALS_COLUMNS = ['username', 'first_name', 'last_name',
+                       'personal_cipher', 'role', 'password']
+
+
+def hash_passwords(passwords):
+    """
+    Захешировать пароли в пуле процессов. PBKDF2 занимает процессор
+    на сотни миллисекунд, поэтому хеширование распределяется по ядрам.
+    Процессы запускаются через spawn, а не fork: воркер gunicorn уже
+    держит фоновые потоки журнала и метрик, и fork мог бы унаследовать
+    захваченные ими блокировки. Django в процессах пула не
+    настраивается, хешированию нужны только настройки PASSWORD_HASHERS.
+    :param passwords: список открытых паролей
+    :return: список хешей в том же порядке
+    """
+    workers = min(settings.USER_IMPORT_HASH_WORKERS, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(
+            make_password, passwords,
+            chunksize=max(len(passwords) // (workers * 4), 1)))
+
+
+def parse_users(content, filename=''):
+    """
+    Прочитать список пользователей из CSV или JSON
+    :param content: содержимое файла
+    :param filename: имя файла, по расширению определяется формат
+    :return: список словарей с данными пользователей
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if filename.endswith('.json') or content.lstrip().startswith(('[', '{')):
+        data = json.loads(content)
+        return data['users'] if isinstance(data, dict) else data
+    return [
+        {key: value for key, value in row.items() if value not in ('', None)}
+        for row in csv.DictReader(io.StringIO(content))
+    ]
+
+
+def credentials_csv(users):
+    """
+    Сформировать CSV с учетными данными созданных пользователей
+    :param users: пользователи с открытыми паролями
+    :return: содержимое CSV
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CREDENTIALS_COLUMNS)
+    for user in users:
+        writer.writerow([getattr(user, column)
+                         for column in CREDENTIALS_COLUMNS])
+    return buffer.getvalue()
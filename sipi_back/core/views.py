@@ -1,9 +1,17 @@
+import csv
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import permissions, status
+from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
+from core.authentication import StreamToken
+from core.conditional import subject_scope, versioned
 from core.filters import BySubjectFilter
 from core.mixins import CreateViewSet, RetrieveListViewSet, \
     RetrieveListCreateDestroy, RetrieveListCreateDestroyUpdate, \
@@ -11,11 +19,25 @@ from core.mixins import CreateViewSet, RetrieveListViewSet, \
 from core.permissions import IsAdmin, IsAdminOrAuthRead, \
     HasFilterQueryParamOrUnsafeMethod, IsModeratorOrAuthRead, IsModerator
 from core.serializers import UsersSerializer, QueueSerializer, PollSerializer,\
-    VoteSerializer, AttendanceSerializer, UsersCreateSerializer
-from core.models import Subject, Queue, Poll, Choice, Attendance
+    VoteSerializer, AttendanceSerializer, UsersCreateSerializer, \
+    PollResultsSerializer, AttendanceBulkSerializer, UsersImportSerializer, \
+    BatchSerializer
+from core.models import Subject, Queue, Poll, Choice, Attendance, \
+    ResourceVersion
+from core import attendance as attendance_data
+from core import batch
+from core import dashboard
+from core import exports
+from core import queue_events
 from core import serializers
+from core import sync
+from core.users_import import credentials_csv, parse_users
+from sipi_back import metrics
+from sipi_back.slow_queries import slow_query_log
 from sipi_back.redoc import sipi_redoc, sipi_redoc_user_me, \
-    sipi_queue_access, queue_list_filtered
+    sipi_queue_access, queue_list_filtered, queue_position, \
+    queue_stream_token, sync_changes, \
+    batch_requests
 from users.models import User
 
 
@@ -27,6 +49,10 @@ class SubjectViewSet(RetrieveListCreateDestroy):
     serializer_class = serializers.SubjectSerializer
     permission_classes = (IsAdminOrAuthRead,)
     lookup_field = 'slug'
+    # На один запрос больше на загрузку пользователя при промахе кеша
+    # и один на версии для ETag
+    query_budget = {'list': 3, 'retrieve': 3}
+    VERSIONS = ((ResourceVersion.SUBJECTS, 0), (ResourceVersion.QUEUE, None))
 
     REDOC_TAG = 'Предметы'
 
@@ -47,6 +73,7 @@ class SubjectViewSet(RetrieveListCreateDestroy):
 
     @sipi_redoc(description=LIST_DESCRIPTION, access_level=1,
                 operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
+    @versioned(*VERSIONS)
     def list(self, request, *args, **kwargs):
         """
         Получить информацию о всех предметах.
@@ -72,6 +99,7 @@ class SubjectViewSet(RetrieveListCreateDestroy):
 
     @sipi_redoc(description=RETRIEVE_DESCRIPTION, access_level=1,
                 operation_id=RETRIEVE_OPERATION_ID, tag=REDOC_TAG)
+    @versioned(*VERSIONS)
     def retrieve(self, request, *args, **kwargs):
         """
         Получить пользователя по slug.
@@ -113,6 +141,7 @@ class SubjectViewSet(RetrieveListCreateDestroy):
         subject = get_object_or_404(Subject, slug=subject_slug)
         subject.is_open = is_open
         subject.save()
+        queue_events.publish_access(subject)
         return Response({'success': f'Subject with slug {subject_slug} '
                                     f'updated successfully.'})
 
@@ -142,6 +171,55 @@ class UserCreateViewSet(CreateViewSet):
         return super().create(request, *args, **kwargs)
 
 
+class UserImportViewSet(CreateViewSet):
+    """
+    Bulk import of users by admin
+    """
+    permission_classes = (IsAdmin,)
+    serializer_class = UsersImportSerializer
+
+    REDOC_TAG = 'Пользователи'
+
+    CREATE_DESCRIPTION = 'Массово создать пользователей. Принимает JSON ' \
+                         'список пользователей, объект {"users": [...]} ' \
+                         'или файл CSV/JSON в поле file. Возвращает CSV ' \
+                         'с сгенерированными паролями.'
+    CREATE_OPERATION_ID = 'Импортировать пользователей'
+
+    IMPORT_FILE_ERR = 'file must be a CSV with a header row or a JSON list.'
+
+    @sipi_redoc(description=CREATE_DESCRIPTION, access_level=3,
+                operation_id=CREATE_OPERATION_ID, tag=REDOC_TAG)
+    def create(self, request, *args, **kwargs):
+        """
+        Обработать массовое создание пользователей
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :param args:  Представляет необязательные позиционные аргументы.
+        :param kwargs: Представляет необязательные именованные аргументы.
+        :return: HttpResponse: CSV файл с учетными данными
+        """
+        upload = request.FILES.get('file')
+        if upload is not None:
+            try:
+                users = parse_users(upload.read(), upload.name)
+            except (ValueError, KeyError, TypeError, csv.Error):
+                return Response({'error': self.IMPORT_FILE_ERR},
+                                status=status.HTTP_400_BAD_REQUEST)
+        elif isinstance(request.data, list):
+            users = request.data
+        else:
+            users = request.data.get('users')
+        serializer = self.get_serializer(data={'users': users})
+        serializer.is_valid(raise_exception=True)
+        created = serializer.save()
+        response = HttpResponse(credentials_csv(created),
+                                content_type='text/csv; charset=utf-8',
+                                status=status.HTTP_201_CREATED)
+        response['Content-Disposition'] = \
+            'attachment; filename="credentials.csv"'
+        return response
+
+
 class UsersViewSet(RetrieveListViewSet):
     """
     Get specified user or users list
@@ -177,6 +255,7 @@ class UsersViewSet(RetrieveListViewSet):
 
     @sipi_redoc(description=LIST_DESCRIPTION,
                 operation_id=LIST_OPERATION_ID, tag=REDOC_TAG, access_level=1)
+    @versioned((ResourceVersion.USERS, 0))
     def list(self, request, *args, **kwargs):
         """
         Получить информацию о всех пользователях.
@@ -190,6 +269,7 @@ class UsersViewSet(RetrieveListViewSet):
     @sipi_redoc(description=RETRIEVE_DESCRIPTION,
                 operation_id=RETRIEVE_OPERATION_ID, tag=REDOC_TAG,
                 access_level=1)
+    @versioned((ResourceVersion.USERS, 0))
     def retrieve(self, request, *args, **kwargs):
         """
         Получить пользователя по id.
@@ -207,9 +287,12 @@ class QueueViewSet(ListCreateDestroy):
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = QueueSerializer
-    queryset = Queue.objects.all()
+    queryset = Queue.objects.select_related('user', 'subject')
     filter_backends = (DjangoFilterBackend,)
     lookup_field = 'slug'
+    query_budget = {'list': 2, 'list_filtered': 4, 'position': 3}
+    # Страницы идут в порядке очереди, как и список без пагинации
+    cursor_ordering = Queue._meta.ordering
 
     REDOC_TAG = 'Очереди'
 
@@ -223,18 +306,29 @@ class QueueViewSet(ListCreateDestroy):
     DESTROY_DESCRIPTION = 'Выйти из очереди'
     DESTROY_OPERATION_ID = 'Выйти из очереди'
 
+    def initial(self, request, *args, **kwargs):
+        """
+        Запомнить время получения запроса до аутентификации и проверки прав,
+        чтобы порядок в очереди не зависел от нагрузки на базу данных.
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :param args:  Представляет необязательные позиционные аргументы.
+        :param kwargs: Представляет необязательные именованные аргументы.
+        :return: None
+        """
+        self.received_at = timezone.now()
+        super().initial(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """
-        Выполнить добавление в очередь
+        Выполнить добавление в очередь. Позиция определяется временем
+        получения запроса, а не порядком вставки в базу данных.
         :param serializer: Сериализатор, используемый для десериализации и
         проверки данных.
         :return: None
         """
-        subject = serializer.validated_data['subject']
-        if not subject.is_open:
-            raise serializers.ValidationError(
-                'Cannot add to queue for a closed subject.')
-        serializer.save(user=self.request.user)
+        serializer.save(user=self.request.user, timestamp=self.received_at)
+        # Вставка идет в обход сигналов модели, событие отправляется здесь
+        queue_events.publish_join(serializer.instance)
 
     @sipi_redoc(description=CREATE_DESCRIPTION, access_level=1,
                 operation_id=CREATE_OPERATION_ID, tag=REDOC_TAG)
@@ -262,6 +356,8 @@ class QueueViewSet(ListCreateDestroy):
 
     @action(detail=False, methods=['get'], url_path='filtered')
     @queue_list_filtered()
+    @versioned(subject_scope(ResourceVersion.QUEUE),
+               (ResourceVersion.USERS, 0))
     def list_filtered(self, request):
         """
         Получить очередь по предмету
@@ -273,11 +369,38 @@ class QueueViewSet(ListCreateDestroy):
             message = {"error": "incorrect filter param"}
             return Response(message, status=status.HTTP_400_BAD_REQUEST)
         subject = get_object_or_404(Subject, slug=slug)
-        queryset = self.filter_queryset(self.get_queryset())
-        queue_items = queryset.filter(subject__slug=slug)
-        serializer = QueueSerializer(queue_items, many=True)
-        data = {"is_open": subject.is_open, "subject_name": subject.title, "queue_persons": serializer.data}
-        return Response(data)
+        return Response(queue_events.queue_state(subject))
+
+    @action(detail=False, methods=['get'], url_path='position')
+    @queue_position()
+    def position(self, request):
+        """
+        Получить место пользователя в очереди по предмету
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response
+        """
+        slug = self.request.query_params.get('subject', None)
+        if not slug:
+            message = {"error": "incorrect filter param"}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        subject = get_object_or_404(Subject, slug=slug)
+        position, queue_length = Queue.objects.position(subject, request.user)
+        return Response({"subject": subject.slug, "position": position,
+                         "queue_length": queue_length})
+
+    @action(detail=False, methods=['post'], url_path='stream-token')
+    @queue_stream_token()
+    def stream_token(self, request):
+        """
+        Выдать короткоживущий токен для потока событий очереди
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response
+        """
+        token = StreamToken.for_user(request.user)
+        return Response({
+            'token': str(token),
+            'expires_in': int(StreamToken.lifetime.total_seconds()),
+        })
 
     @sipi_redoc(description=DESTROY_DESCRIPTION, access_level=1,
                 operation_id=DESTROY_OPERATION_ID, tag=REDOC_TAG)
@@ -304,10 +427,13 @@ class PollViewSet(RetrieveListCreateDestroy):
     queryset = Poll.objects.all()
     serializer_class = PollSerializer
     permission_classes = [IsModeratorOrAuthRead]
+    query_budget = {'list': 5, 'retrieve': 5}
 
     REDOC_TAG = 'Опросы'
 
-    LIST_DESCRIPTION = 'Получить список опросов'
+    LIST_DESCRIPTION = 'Получить список опросов. С параметром ' \
+                       '<code>?results=true</code> возвращаются только ' \
+                       'итоги голосования в процентах.'
     LIST_OPERATION_ID = 'Получить список опросов'
 
     CREATE_DESCRIPTION = 'Создать опрос'
@@ -319,8 +445,41 @@ class PollViewSet(RetrieveListCreateDestroy):
     DESTROY_DESCRIPTION = 'Удалить опрос'
     DESTROY_OPERATION_ID = 'Удалить опрос'
 
+    READ_ACTIONS = ('list', 'retrieve')
+
+    @property
+    def results_only(self):
+        """
+        Запрошен ли режим только итогов голосования
+        """
+        return self.request.query_params.get('results') in ('true', '1')
+
+    def get_queryset(self):
+        """
+        Получить опросы вместе с вариантами и голосами текущего пользователя.
+        Список выполняется за постоянное число запросов.
+        :return: QuerySet опросов
+        """
+        queryset = super().get_queryset()
+        if self.action not in self.READ_ACTIONS:
+            return queryset
+        queryset = queryset.with_choices()
+        if self.results_only:
+            return queryset
+        return queryset.with_user_votes(self.request.user)
+
+    def get_serializer_class(self):
+        """
+        Выбрать облегченный сериализатор для режима итогов голосования
+        :return: класс сериализатора
+        """
+        if self.action in self.READ_ACTIONS and self.results_only:
+            return PollResultsSerializer
+        return super().get_serializer_class()
+
     @sipi_redoc(description=LIST_DESCRIPTION, access_level=1,
                 operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
+    @versioned((ResourceVersion.POLLS, 0), per_user=True)
     def list(self, request, *args, **kwargs):
         """
         Получить список опросов.
@@ -346,6 +505,7 @@ class PollViewSet(RetrieveListCreateDestroy):
 
     @sipi_redoc(description=RETRIEVE_DESCRIPTION, access_level=1,
                 operation_id=RETRIEVE_OPERATION_ID, tag=REDOC_TAG)
+    @versioned((ResourceVersion.POLLS, 0), per_user=True)
     def retrieve(self, request, *args, **kwargs):
         """
         Получить опрос по id.
@@ -399,11 +559,12 @@ class AttendanceViewSet(RetrieveListCreateDestroyUpdate):
     """
     Вьюсет обрабатывающий запросы по посещаемости.
     """
-    queryset = Attendance.objects.all()
+    queryset = Attendance.objects.select_related('subject', 'student')
     serializer_class = AttendanceSerializer
     permission_classes = [IsModeratorOrAuthRead,
                           HasFilterQueryParamOrUnsafeMethod]
     filterset_class = BySubjectFilter
+    query_budget = {'list': 2, 'retrieve': 2, 'matrix': 4, 'stats': 5}
 
     REDOC_TAG = 'Посещаемость'
 
@@ -431,17 +592,177 @@ class AttendanceViewSet(RetrieveListCreateDestroyUpdate):
                           'пары, урока и т.д.'
     DESTROY_OPERATION_ID = 'Удалить отметку о посещаемости'
 
+    BULK_DESCRIPTION = 'Отметить посещаемость всех студентов за одно ' \
+                       'занятие одним запросом. Существующие отметки ' \
+                       'обновляются. <br>Параметр lesson_serial_number - ' \
+                       'Порядковый номер пары, урока и т.д.'
+    BULK_OPERATION_ID = 'Отметить посещаемость за занятие'
+
+    MATRIX_DESCRIPTION = 'Получить матрицу посещаемости по slug предмета: ' \
+                         'одна строка на студента с битовыми масками. ' \
+                         'Бит n - 1 соответствует занятию n, ' \
+                         'present_mask - присутствие, recorded_mask - ' \
+                         'проставленные отметки. Например: ' \
+                         '/api/attendance/matrix/?subject=ost'
+    MATRIX_OPERATION_ID = 'Получить матрицу посещаемости'
+
+    STATS_DESCRIPTION = 'Получить процент посещаемости по студентам и ' \
+                        'по занятиям предмета. Например: ' \
+                        '/api/attendance/stats/?subject=ost'
+    STATS_OPERATION_ID = 'Получить статистику посещаемости'
+
+    def get_object(self):
+        """
+        Получить отметку по id. В компактном режиме хранения отметка
+        собирается из строки масок.
+        :return: Attendance
+        """
+        if not attendance_data.bitset_storage():
+            return super().get_object()
+        try:
+            pk = int(self.kwargs['pk'])
+        except ValueError:
+            raise Http404
+        attendance = attendance_data.attendance_in_bulk([pk]).get(pk)
+        if attendance is None:
+            raise Http404
+        self.check_object_permissions(self.request, attendance)
+        return attendance
+
+    def perform_create(self, serializer):
+        """
+        Создать отметку и учесть ее в производных данных посещаемости
+        :param serializer: Сериализатор отметки
+        :return: None
+        """
+        with transaction.atomic():
+            attendance_data.lock_subjects(
+                serializer.validated_data['subject'].pk)
+            if attendance_data.bitset_storage():
+                serializer.instance = attendance_data.save_attendance(
+                    Attendance(**serializer.validated_data))
+                return
+            attendance = serializer.save()
+            attendance_data.apply_changes(
+                added=[attendance_data.mark_of(attendance)])
+
+    def perform_update(self, serializer):
+        """
+        Изменить отметку и учесть изменение в производных данных
+        посещаемости
+        :param serializer: Сериализатор отметки
+        :return: None
+        """
+        with transaction.atomic():
+            subject = serializer.validated_data.get('subject')
+            attendance_data.lock_subjects(
+                serializer.instance.subject_id,
+                *([subject.pk] if subject else []))
+            if attendance_data.bitset_storage():
+                old_mark = attendance_data.mark_of(serializer.instance)
+                for name, value in serializer.validated_data.items():
+                    setattr(serializer.instance, name, value)
+                attendance_data.save_attendance(serializer.instance, old_mark)
+                return
+            # Отметка перечитывается после блокировки: ее могли изменить
+            # после загрузки представлением
+            serializer.instance.refresh_from_db()
+            old_mark = attendance_data.mark_of(serializer.instance)
+            attendance = serializer.save()
+            attendance_data.apply_changes(
+                added=[attendance_data.mark_of(attendance)],
+                removed=[old_mark])
+
+    def perform_destroy(self, instance):
+        """
+        Удалить отметку. Построчную отметку в производных данных учитывает
+        сигнал удаления, в компактном режиме снимается бит маски.
+        :param instance: отметка
+        :return: None
+        """
+        if not attendance_data.bitset_storage():
+            return super().perform_destroy(instance)
+        with transaction.atomic():
+            attendance_data.lock_subjects(instance.subject_id)
+            attendance_data.write_marks(
+                deleted=[attendance_data.mark_of(instance)])
+
+    @action(methods=['GET'], detail=False, url_path='matrix')
+    @sipi_redoc(description=MATRIX_DESCRIPTION, access_level=1,
+                operation_id=MATRIX_OPERATION_ID, tag=REDOC_TAG)
+    @versioned(subject_scope(ResourceVersion.ATTENDANCE),
+               (ResourceVersion.USERS, 0))
+    def matrix(self, request):
+        """
+        Получить матрицу посещаемости по предмету
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response
+        """
+        slug = self.request.query_params.get('subject', None)
+        if not slug:
+            message = {"error": "incorrect filter param"}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        subject = get_object_or_404(Subject, slug=slug)
+        return Response({'subject': subject.slug,
+                         'lessons': attendance_data.LESSONS_COUNT,
+                         'students': attendance_data.matrix(subject)})
+
+    @action(methods=['GET'], detail=False, url_path='stats')
+    @sipi_redoc(description=STATS_DESCRIPTION, access_level=1,
+                operation_id=STATS_OPERATION_ID, tag=REDOC_TAG)
+    @versioned(subject_scope(ResourceVersion.ATTENDANCE),
+               (ResourceVersion.USERS, 0))
+    def stats(self, request):
+        """
+        Получить статистику посещаемости по предмету
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response
+        """
+        slug = self.request.query_params.get('subject', None)
+        if not slug:
+            message = {"error": "incorrect filter param"}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        subject = get_object_or_404(Subject, slug=slug)
+        return Response({'subject': subject.slug,
+                         **attendance_data.stats(subject)})
+
+    @action(methods=['POST'], detail=False, url_path='bulk',
+            permission_classes=[IsModerator],
+            serializer_class=AttendanceBulkSerializer)
+    @sipi_redoc(description=BULK_DESCRIPTION, access_level=2,
+                operation_id=BULK_OPERATION_ID, tag=REDOC_TAG)
+    def bulk(self, request):
+        """
+        Обработать массовую отметку посещаемости.
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response: Сводка по отметкам
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        summary = serializer.save()
+        return Response(summary, status=status.HTTP_201_CREATED)
+
     @sipi_redoc(description=LIST_DESCRIPTION, access_level=1,
                 operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
     def list(self, request, *args, **kwargs):
         """
-        Получить список посещаемости по фильтру предмета.
+        Получить список посещаемости по фильтру предмета. В компактном
+        режиме хранения страница содержит отметки page_size студентов.
         :param request: Объект запроса, содержащий данные о запросе клиента.
         :param args:  Представляет необязательные позиционные аргументы.
         :param kwargs: Представляет необязательные именованные аргументы.
         :return: Возвращает результат метода list родительского класса
         """
-        return super().list(request, *args, **kwargs)
+        if not attendance_data.bitset_storage():
+            return super().list(request, *args, **kwargs)
+        masks = self.filter_queryset(attendance_data.stored_masks())
+        page = self.paginate_queryset(masks)
+        serializer = self.get_serializer(
+            list(attendance_data.attendance_of_masks(
+                masks if page is None else page)), many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
     @sipi_redoc(description=CREATE_DESCRIPTION, access_level=2,
                 operation_id=CREATE_OPERATION_ID, tag=REDOC_TAG)
@@ -490,3 +811,228 @@ class AttendanceViewSet(RetrieveListCreateDestroyUpdate):
         :return: Возвращает результат метода destroy родительского класса
         """
         return super().destroy(request, *args, **kwargs)
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Потоковая выгрузка данных в CSV или JSONL
+    """
+    permission_classes = [IsModerator]
+
+    REDOC_TAG = 'Выгрузка'
+
+    FORMAT_DESCRIPTION = '<br>Параметр fmt - формат выгрузки: csv ' \
+                         '(по умолчанию) или jsonl. Строки отдаются ' \
+                         'потоком по мере чтения из базы данных.'
+
+    ATTENDANCE_DESCRIPTION = 'Выгрузить посещаемость. Необязательный ' \
+                             'параметр subject - slug предмета.' \
+                             + FORMAT_DESCRIPTION
+    ATTENDANCE_OPERATION_ID = 'Выгрузить посещаемость'
+
+    QUEUE_DESCRIPTION = 'Выгрузить текущие очереди. Необязательный ' \
+                        'параметр subject - slug предмета.' \
+                        + FORMAT_DESCRIPTION
+    QUEUE_OPERATION_ID = 'Выгрузить очереди'
+
+    POLLS_DESCRIPTION = 'Выгрузить результаты опросов.' + FORMAT_DESCRIPTION
+    POLLS_OPERATION_ID = 'Выгрузить результаты опросов'
+
+    def export(self, name, columns, queryset):
+        """
+        Сформировать потоковый ответ с выгрузкой
+        :param name: имя файла без расширения
+        :param columns: названия колонок
+        :param queryset: QuerySet или генератор кортежей
+        :return: StreamingHttpResponse или Response с ошибкой
+        """
+        export_format = self.request.query_params.get('fmt', 'csv')
+        if export_format not in exports.EXPORT_FORMATS:
+            message = {"error": "fmt must be one of: "
+                                f"{', '.join(exports.EXPORT_FORMATS)}"}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            exports.stream(columns, queryset, export_format),
+            content_type=exports.EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = \
+            f'attachment; filename="{name}.{export_format}"'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='attendance')
+    @sipi_redoc(description=ATTENDANCE_DESCRIPTION, access_level=2,
+                operation_id=ATTENDANCE_OPERATION_ID, tag=REDOC_TAG)
+    def attendance(self, request):
+        """
+        Выгрузить посещаемость
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: StreamingHttpResponse
+        """
+        columns, queryset = exports.attendance_rows(
+            request.query_params.get('subject'))
+        return self.export('attendance', columns, queryset)
+
+    @action(detail=False, methods=['get'], url_path='queue')
+    @sipi_redoc(description=QUEUE_DESCRIPTION, access_level=2,
+                operation_id=QUEUE_OPERATION_ID, tag=REDOC_TAG)
+    def queue(self, request):
+        """
+        Выгрузить очереди
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: StreamingHttpResponse
+        """
+        columns, queryset = exports.queue_rows(
+            request.query_params.get('subject'))
+        return self.export('queue', columns, queryset)
+
+    @action(detail=False, methods=['get'], url_path='polls')
+    @sipi_redoc(description=POLLS_DESCRIPTION, access_level=2,
+                operation_id=POLLS_OPERATION_ID, tag=REDOC_TAG)
+    def polls(self, request):
+        """
+        Выгрузить результаты опросов
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: StreamingHttpResponse
+        """
+        columns, queryset = exports.poll_rows()
+        return self.export('polls', columns, queryset)
+
+
+class DashboardViewSet(viewsets.ViewSet):
+    """
+    Данные стартового экрана клиента одним запросом
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    # Версии для ETag, предметы, места в очередях, опросы, варианты,
+    # голоса и загрузка пользователя при промахе кеша
+    query_budget = 7
+
+    REDOC_TAG = 'Стартовый экран'
+
+    LIST_DESCRIPTION = 'Получить одним запросом текущего пользователя, ' \
+                       'предметы с открытостью очереди и числом людей в ' \
+                       'ней, свое место в каждой очереди (null, если ' \
+                       'пользователь не в очереди) и опросы с отметкой ' \
+                       'голосования пользователя. Время сборки разделов ' \
+                       'передается в заголовке Server-Timing.'
+    LIST_OPERATION_ID = 'Получить стартовый экран'
+
+    @sipi_redoc(description=LIST_DESCRIPTION, access_level=1,
+                operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
+    @versioned((ResourceVersion.SUBJECTS, 0), (ResourceVersion.QUEUE, None),
+               (ResourceVersion.POLLS, 0), (ResourceVersion.USERS, 0),
+               per_user=True)
+    def list(self, request):
+        """
+        Получить данные стартового экрана
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response: пользователь, предметы, очереди и опросы
+        """
+        data, timings = dashboard.build(request)
+        return Response(data, headers={'Server-Timing': timings.header()})
+
+
+class BatchViewSet(viewsets.ViewSet):
+    """
+    Пакетное выполнение запросов к API
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @batch_requests()
+    def create(self, request):
+        """
+        Выполнить вложенные запросы через существующие представления с
+        одной аутентификацией
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response: ответы вложенных запросов по порядку
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(batch.run(request,
+                                  serializer.validated_data['requests'],
+                                  serializer.validated_data['atomic']))
+
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    Синхронизация изменений по журналу
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    # Горизонт журнала, записи, по одному запросу на каждую модель и
+    # загрузка пользователя при промахе кеша
+    query_budget = 3 + len(sync.SYNC_MODELS)
+
+    SINCE_ERR = 'since and limit params must be non-negative integers.'
+
+    @sync_changes()
+    def list(self, request):
+        """
+        Получить изменения после курсора
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response: изменения и новый курсор
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit',
+                                                 settings.SYNC_PAGE_SIZE))
+        except ValueError:
+            since = limit = None
+        if since is None or since < 0 or limit < 1:
+            return Response({'error': self.SINCE_ERR},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(sync.changes(since,
+                                     min(limit, settings.SYNC_PAGE_SIZE)))
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    Метрики запросов в формате Prometheus
+    """
+    permission_classes = [IsAdmin]
+
+    REDOC_TAG = 'Метрики'
+
+    LIST_DESCRIPTION = 'Получить задержки, число запросов по классам ' \
+                       'статусов и объем ответов по маршрутам API, ' \
+                       'суммированные по всем воркерам, в текстовом ' \
+                       'формате Prometheus. Данные других воркеров ' \
+                       'обновляются раз в METRICS_FLUSH_INTERVAL секунд.'
+    LIST_OPERATION_ID = 'Получить метрики запросов'
+
+    @sipi_redoc(description=LIST_DESCRIPTION, access_level=3,
+                operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
+    def list(self, request):
+        """
+        Получить метрики запросов
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: HttpResponse: метрики в текстовом формате
+        """
+        return HttpResponse(
+            metrics.render(metrics.request_metrics.collect()),
+            content_type=metrics.CONTENT_TYPE)
+
+
+class SlowQueryViewSet(viewsets.ViewSet):
+    """
+    Журнал медленных SQL запросов
+    """
+    permission_classes = [IsAdmin]
+
+    REDOC_TAG = 'Метрики'
+
+    LIST_DESCRIPTION = 'Получить медленные SQL запросы воркера, ' \
+                       'обработавшего запрос: время выполнения, ' \
+                       'представление, типы параметров и план EXPLAIN ' \
+                       '(появляется с задержкой). Журнал включается ' \
+                       'настройкой SLOW_QUERY_LOG, порог задает ' \
+                       'SLOW_QUERY_THRESHOLD_MS.'
+    LIST_OPERATION_ID = 'Получить медленные запросы'
+
+    @sipi_redoc(description=LIST_DESCRIPTION, access_level=3,
+                operation_id=LIST_OPERATION_ID, tag=REDOC_TAG)
+    def list(self, request):
+        """
+        Получить медленные запросы
+        :param request: Объект запроса, содержащий данные о запросе клиента.
+        :return: Response: список запросов, новые первыми
+        """
+        return Response(slow_query_log.list())
@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sipi_back.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после настройки Django: модуль использует модели
+from core.queue_events import EVENTS_PATH, queue_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    Поток событий очереди обслуживается напрямую, остальные запросы
+    передаются Django
+    """
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await queue_events(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Максимальный размер сообщения между процессами
+DATAGRAM_SIZE = 64 * 1024
+
+
+class Subscription:
+    """
+    Подписка на канал: очередь сообщений в цикле событий подписчика.
+    Если подписчик не успевает читать, сообщения отбрасываются, а флаг
+    lost сообщает, что состояние нужно запросить заново.
+    """
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.lost = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lost = True
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    Pub/sub в памяти процесса. Публиковать можно из любого потока,
+    подписчики получают сообщения в своем цикле событий.
+    """
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """
+        Подписаться на канал. Вызывается из цикла событий.
+        :param channel: имя канала
+        :return: Subscription
+        """
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(subscription.channel, None)
+
+    def lose(self, channel):
+        """
+        Сообщить подписчикам канала в этом процессе, что сообщения были
+        потеряны и состояние нужно запросить заново
+        :param channel: имя канала
+        :return: None
+        """
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(
+                setattr, subscription, 'lost', True)
+
+    def publish(self, channel, message):
+        """
+        Отправить сообщение подписчикам канала в этом процессе
+        :param channel: имя канала
+        :param message: словарь, сериализуемый в JSON
+        :return: None
+        """
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(
+                subscription.deliver, message)
+
+
+class UnixSocketBroker(LocalBroker):
+    """
+    Pub/sub между процессами одного хоста. Каждый ASGI процесс с
+    подписчиками слушает датаграммный сокет EVENTS_SOCKET_DIR/<pid>.sock,
+    а публикующий процесс (в том числе воркер gunicorn) рассылает
+    сообщение во все сокеты каталога. Датаграммы нумеруются отдельно для
+    каждой пары (сокет получателя, канал), и пропуск номера у получателя
+    означает потерянное сообщение.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.directory = settings.EVENTS_SOCKET_DIR
+        self.listening_pid = None
+        self.sender = None
+        self.sender_pid = None
+        self.send_lock = threading.Lock()
+        # Последний отправленный номер: {(путь сокета, канал): номер}
+        self.sent = {}
+        # Последний полученный номер: {(pid отправителя, канал): номер}
+        self.received = {}
+
+    def subscribe(self, channel):
+        if self.listening_pid != os.getpid():
+            self.listen()
+        return super().subscribe(channel)
+
+    def listen(self):
+        """
+        Открыть сокет процесса и запустить поток приема сообщений
+        :return: None
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'{os.getpid()}.sock'
+        if path.exists():
+            path.unlink()
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(str(path))
+        self.listening_pid = os.getpid()
+        threading.Thread(target=self.receive, args=(receiver,),
+                         name='events-receiver', daemon=True).start()
+
+    def receive(self, receiver):
+        while True:
+            channel, message, sender, seq = json.loads(
+                receiver.recv(DATAGRAM_SIZE))
+            # Первое сообщение от процесса имеет номер 1, поэтому потеря
+            # обнаруживается и до первого полученного сообщения
+            if seq != self.received.get((sender, channel), 0) + 1:
+                self.lose(channel)
+            self.received[sender, channel] = seq
+            super().publish(channel, message)
+
+    def publish(self, channel, message):
+        with self.send_lock:
+            # Номера начинаются заново в каждом процессе, в том числе в
+            # воркере, созданном fork после первой отправки
+            if self.sender_pid != os.getpid():
+                self.sender = socket.socket(socket.AF_UNIX,
+                                            socket.SOCK_DGRAM)
+                self.sender.setblocking(False)
+                self.sender_pid = os.getpid()
+                self.sent = {}
+            if not self.directory.exists():
+                return
+            for path in self.directory.glob('*.sock'):
+                key = (str(path), channel)
+                seq = self.sent[key] = self.sent.get(key, 0) + 1
+                data = json.dumps(
+                    [channel, message, os.getpid(), seq]).encode()
+                try:
+                    self.sender.sendto(data, str(path))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Процесс завершился, не удалив свой сокет
+                    path.unlink(missing_ok=True)
+                    self.sent = {sent_key: sent for sent_key, sent
+                                 in self.sent.items()
+                                 if sent_key[0] != str(path)}
+                except BlockingIOError:
+                    # Буфер получателя переполнен: сообщение теряется, а
+                    # получатель увидит пропуск номера и отправит
+                    # подписчикам канала свежий снимок очереди
+                    pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Получить брокер событий процесса, заданный QUEUE_EVENTS_BROKER
+    :return: LocalBroker или его наследник
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.QUEUE_EVENTS_BROKER)()
+        return _broker
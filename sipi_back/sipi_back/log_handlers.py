@@ -0,0 +1,277 @@
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# Атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message'}
+
+ROLLOVER_INTERVALS = {
+    'S': 1,
+    'M': 60,
+    'H': 60 * 60,
+    'D': 60 * 60 * 24,
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирование записи лога в одну строку JSON. Дополнительные поля,
+    переданные через extra, добавляются в объект как есть.
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    Файловый обработчик, записывающий пачку записей с одним flush и
+    ротирующий файл по размеру или по времени. Файл пишут несколько
+    воркеров, поэтому ротация выполняется под межпроцессной блокировкой
+    и только одним из них.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, when=None,
+                 encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes,
+                         backupCount=backup_count, encoding=encoding,
+                         delay=True)
+        self.interval = ROLLOVER_INTERVALS[when.upper()] if when else None
+        self.rollover_at = self.next_rollover()
+
+    def next_rollover(self):
+        if self.interval is None:
+            return None
+        now = time.time()
+        return now - now % self.interval + self.interval
+
+    def should_rollover(self, message):
+        """
+        Проверить, нужно ли начать новый файл перед записью строки
+        :param message: строка для записи
+        :return: bool
+        """
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.maxBytes > 0 and self.stream is not None:
+            # В файл пишут и другие процессы: размер берется по концу файла
+            position = self.stream.seek(0, os.SEEK_END)
+            return position > 0 and \
+                position + len(message) >= self.maxBytes
+        return False
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self.next_rollover()
+
+    def reopen_if_rotated(self):
+        """
+        Закрыть файл, если его уже ротировал другой процесс, и перенести
+        время следующей ротации на следующую границу интервала
+        :return: True, если файл был ротирован другим процессом
+        """
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.stream.fileno())
+        if current is not None and (current.st_dev, current.st_ino) == \
+                (opened.st_dev, opened.st_ino):
+            return False
+        self.stream.close()
+        self.stream = None
+        self.rollover_at = self.next_rollover()
+        return True
+
+    @contextlib.contextmanager
+    def rollover_lock(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def rollover(self, message):
+        """
+        Ротировать файл, если другой процесс не сделал этого раньше.
+        После чужой ротации условия по времени и размеру проверяются
+        заново уже для нового файла.
+        :param message: строка, перед записью которой нужна ротация
+        :return: None
+        """
+        with self.rollover_lock():
+            if self.reopen_if_rotated():
+                self.stream = self._open()
+                if not self.should_rollover(message):
+                    return
+            self.doRollover()
+
+    def write_batch(self, messages):
+        """
+        Записать готовые строки и сбросить буфер один раз
+        :param messages: список отформатированных строк
+        :return: None
+        """
+        with self.lock:
+            self.reopen_if_rotated()
+            if self.stream is None:
+                self.stream = self._open()
+            for message in messages:
+                if self.should_rollover(message):
+                    self.rollover(message)
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(message + self.terminator)
+            self.stream.flush()
+
+
+class AsyncLogHandler(logging.Handler):
+    """
+    Неблокирующий обработчик: запрос только кладет запись в ограниченную
+    очередь, а фоновый поток пачками пишет строки в файл и в консоль.
+    Если очередь переполнена, запись отбрасывается, а число потерянных
+    записей попадает в лог отдельной строкой.
+    """
+
+    STOP = object()
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, when=None,
+                 queue_size=10000, batch_size=500, flush_interval=0.5,
+                 console=True):
+        super().__init__()
+        self.file_handler = BatchRotatingFileHandler(
+            filename, max_bytes=max_bytes, backup_count=backup_count,
+            when=when)
+        self.console = console
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        """
+        Запустить фоновый поток записи в текущем процессе. Поток
+        запускается лениво, поэтому переживает fork воркеров.
+        :return: None
+        """
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.dropped = 0
+            self.thread = threading.Thread(
+                target=self.listen, name='async-log-listener', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def prepare(self, record):
+        """
+        Подготовить запись к передаче в другой поток: подставить аргументы
+        в сообщение и заменить traceback текстом
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def next_batch(self):
+        """
+        Дождаться первой записи и добрать из очереди остальные без ожидания
+        :return: (список записей, нужно ли остановиться)
+        """
+        try:
+            records = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return [], False
+        while len(records) < self.batch_size:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = any(record is self.STOP for record in records)
+        return [record for record in records if record is not self.STOP], stop
+
+    def listen(self):
+        stop = False
+        while not stop:
+            records, stop = self.next_batch()
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                records.append(logging.makeLogRecord({
+                    'name': __name__,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': 'Log queue overflow, records dropped',
+                    'dropped': dropped,
+                }))
+            if records:
+                self.write(records)
+
+    def write(self, records):
+        """
+        Отформатировать и записать пачку записей
+        :param records: список записей
+        :return: None
+        """
+        try:
+            messages = [self.format(record) for record in records]
+            self.file_handler.write_batch(messages)
+            if self.console:
+                sys.stderr.write(''.join(
+                    message + '\n' for message in messages))
+                sys.stderr.flush()
+        except Exception:
+            self.handleError(records[-1])
+
+    def close(self):
+        """
+        Дописать оставшиеся записи и остановить фоновый поток
+        """
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(timeout=5)
+        self.file_handler.close()
+        super().close()
@@ -0,0 +1,197 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# Границы корзин гистограммы задержек в секундах
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+
+UNMATCHED_ROUTE = 'unmatched'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def new_series():
+    return {
+        'buckets': [0] * (len(DURATION_BUCKETS) + 1),
+        'duration_sum': 0.0,
+        'count': 0,
+        'bytes': 0,
+        'statuses': defaultdict(int),
+    }
+
+
+class RequestMetrics:
+    """
+    Счетчики запросов текущего процесса по маршрутам. Запись идет только
+    в память, фоновый поток периодически сохраняет снимок в файл
+    METRICS_DIR/<pid>.json, откуда его читает эндпоинт метрик любого
+    воркера.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.series = defaultdict(new_series)
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self):
+        """
+        Запустить фоновое сохранение счетчиков в текущем процессе
+        :return: None
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # После fork счетчики родителя не относятся к воркеру
+            self.series.clear()
+            self.pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self.flush_loop, name='metrics-flush',
+                         daemon=True).start()
+
+    def record(self, route, method, status_code, duration, size):
+        """
+        Учесть завершенный запрос
+        :param route: имя маршрута
+        :param method: HTTP метод
+        :param status_code: код ответа
+        :param duration: длительность в секундах
+        :param size: размер ответа в байтах или None
+        :return: None
+        """
+        if self.pid != os.getpid():
+            self.start()
+        bucket = bisect.bisect_left(DURATION_BUCKETS, duration)
+        with self.lock:
+            series = self.series[route, method]
+            series['buckets'][bucket] += 1
+            series['duration_sum'] += duration
+            series['count'] += 1
+            series['bytes'] += size or 0
+            series['statuses'][f'{status_code // 100}xx'] += 1
+
+    def snapshot(self):
+        """
+        Получить копию счетчиков процесса
+        :return: список словарей по маршрутам
+        """
+        with self.lock:
+            return [
+                dict(series, route=route, method=method,
+                     buckets=list(series['buckets']),
+                     statuses=dict(series['statuses']))
+                for (route, method), series in self.series.items()
+            ]
+
+    def flush(self):
+        """
+        Атомарно записать снимок счетчиков в файл процесса
+        :return: None
+        """
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+
+    def flush_loop(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        """
+        Сложить счетчики всех воркеров, включая завершившиеся
+        :return: словарь {(маршрут, метод): счетчики}
+        """
+        if self.pid == os.getpid():
+            self.flush()
+        total = defaultdict(new_series)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    rows = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for row in rows:
+                series = total[row['route'], row['method']]
+                for index, count in enumerate(row['buckets']):
+                    series['buckets'][index] += count
+                series['duration_sum'] += row['duration_sum']
+                series['count'] += row['count']
+                series['bytes'] += row['bytes']
+                for status_class, count in row['statuses'].items():
+                    series['statuses'][status_class] += count
+        return total
+
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def render(total):
+    """
+    Сформировать метрики в текстовом формате Prometheus
+    :param total: результат RequestMetrics.collect
+    :return: строка
+    """
+    lines = [
+        '# HELP http_requests_total Requests by route, method and '
+        'status class.',
+        '# TYPE http_requests_total counter',
+    ]
+    keys = sorted(total)
+    for route, method in keys:
+        for status_class, count in sorted(
+                total[route, method]['statuses'].items()):
+            lines.append(
+                f'http_requests_total{{route="{label(route)}",'
+                f'method="{method}",status="{status_class}"}} {count}')
+    lines += [
+        '# HELP http_request_duration_seconds Request latency by route.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for route, method in keys:
+        series = total[route, method]
+        labels = f'route="{label(route)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + ('+Inf',),
+                                series['buckets']):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket'
+                         f'{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} '
+                     f'{series["duration_sum"]}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} '
+                     f'{series["count"]}')
+    lines += [
+        '# HELP http_response_bytes_total Response body bytes by route.',
+        '# TYPE http_response_bytes_total counter',
+    ]
+    for route, method in keys:
+        lines.append(
+            f'http_response_bytes_total{{route="{label(route)}",'
+            f'method="{method}"}} {total[route, method]["bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics(settings.METRICS_DIR,
+                                 settings.METRICS_FLUSH_INTERVAL)
@@ -1,8 +1,13 @@
 import logging
-import datetime
-import urllib.parse
+import time
 
+from django.conf import settings
+
+from sipi_back.metrics import UNMATCHED_ROUTE, request_metrics
+from sipi_back.queries import QueryBudgetExceeded, QueryInspector, \
+    view_budget
 from sipi_back.settings import DEBUG
+from sipi_back.slow_queries import set_current_view
 
 logger = logging.getLogger(__name__)
 
@@ -11,13 +16,10 @@ class RequestLoggingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
-    import urllib.parse
-
     def __call__(self, request):
+        started = time.perf_counter()
         response = self.get_response(request)
-        time = datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S")
-        endpoint = request.path
-        method = request.method
+        duration = time.perf_counter() - started
         username = request.user.username \
             if request.user.is_authenticated else 'anonymous'
         if DEBUG is True:
@@ -27,11 +29,98 @@ class RequestLoggingMiddleware:
             ip_address = remote_addr.split(',')[0].strip() if remote_addr else \
                 'unknown'
 
-        # Extracting and logging URL parameters
-        params = str(urllib.parse.urlencode(request.GET))
-        params_str = f'?{params}' if params else ''
-        log_data = f'{time}, {method}: {endpoint}{params_str}, ' \
-                   f'user: {username}, status code: {response.status_code},' \
-                   f' IP: {ip_address}'
-        logger.info(log_data)
+        size = self.response_size(response)
+        match = request.resolver_match
+        request_metrics.record(
+            match.view_name if match else UNMATCHED_ROUTE, request.method,
+            response.status_code, duration, size)
+
+        # Форматирование в JSON выполняет фоновый поток обработчика логов
+        logger.info('request', extra={
+            'method': request.method,
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'size': size,
+            'user': username,
+            'ip': ip_address,
+        })
+        return response
+
+    @staticmethod
+    def response_size(response):
+        """
+        Получить размер тела ответа в байтах
+        :param response: ответ
+        :return: размер или None для потокового ответа неизвестной длины
+        """
+        if response.has_header('Content-Length'):
+            return int(response['Content-Length'])
+        if response.streaming:
+            return None
+        return len(response.content)
+
+
+class QueryInspectionMiddleware:
+    """
+    Подсчет SQL запросов представления. Запоминает имя представления
+    для журнала медленных запросов. Если у представления задан
+    query_budget, превышение бюджета вызывает исключение при
+    QUERY_BUDGET_STRICT (тесты) или предупреждение в логе. При
+    QUERY_INSPECTION (разработка, стенд) дополнительно ищет повторяющиеся
+    формы запросов (N+1) и поля сериализаторов, которые их вызвали.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.detailed = settings.QUERY_INSPECTION
+        self.threshold = settings.QUERY_N_PLUS_ONE_THRESHOLD
+        self.strict = settings.QUERY_BUDGET_STRICT
+
+    def __call__(self, request):
+        # Запросы считаются вокруг обычного пути обработки, чтобы не
+        # обходить process_view и process_exception других middleware
+        # и обертку ATOMIC_REQUESTS
+        try:
+            with QueryInspector(detailed=self.detailed) as inspector:
+                response = self.get_response(request)
+        finally:
+            set_current_view(None)
+        match = request.resolver_match
+        budget = view_budget(match.func, request.method) if match else None
+        self.report(request, inspector, budget)
+        if self.detailed:
+            response['X-Query-Count'] = inspector.count
         return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        set_current_view(request.resolver_match.view_name)
+
+    def report(self, request, inspector, budget):
+        """
+        Сообщить о N+1 и превышении бюджета запросов
+        :param request: запрос
+        :param inspector: QueryInspector с результатами
+        :param budget: бюджет запросов или None
+        :return: None
+        """
+        route = f'{request.method} {request.path}'
+        if self.detailed:
+            for shape, count, fields in inspector.repeated(self.threshold):
+                logger.warning('Possible N+1 query', extra={
+                    'route': route,
+                    'repeats': count,
+                    'fields': fields,
+                    'sql': shape,
+                })
+        if budget is not None and inspector.count > budget:
+            message = f'{route} executed {inspector.count} queries, ' \
+                      f'budget is {budget}'
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Query budget exceeded', extra={
+                'route': route,
+                'queries': inspector.count,
+                'budget': budget,
+            })
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control
+from django.views.decorators.http import require_safe
+
+from sipi_back.redoc import api_info
+
+SCHEMA_FORMATS = {
+    '.json': ('OpenAPICodecJson', 'application/json; charset=utf-8'),
+    '.yaml': ('OpenAPICodecYaml', 'application/yaml; charset=utf-8'),
+}
+
+_schemas = {}
+_lock = threading.Lock()
+
+
+def generate(schema_format):
+    """
+    Сгенерировать схему OpenAPI по всем представлениям
+    :param schema_format: .json или .yaml
+    :return: содержимое схемы в байтах
+    """
+    from drf_yasg import codecs
+    from drf_yasg.app_settings import swagger_settings
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    codec = getattr(codecs, SCHEMA_FORMATS[schema_format][0])
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(api_info())
+    # Представления читают параметры запроса при построении схемы,
+    # поэтому генерация идет от имени анонимного запроса к схеме
+    request = Request(APIRequestFactory().get(f'/api/swagger{schema_format}'))
+    return codec(validators=[]).encode(
+        generator.get_schema(request=request, public=True))
+
+
+def write_files():
+    """
+    Записать схему во всех форматах в OPENAPI_SCHEMA_DIR
+    :return: список путей к файлам
+    """
+    settings.OPENAPI_SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for schema_format in SCHEMA_FORMATS:
+        path = settings.OPENAPI_SCHEMA_DIR / f'swagger{schema_format}'
+        path.write_bytes(generate(schema_format))
+        paths.append(path)
+    return paths
+
+
+def load(schema_format):
+    """
+    Получить схему и ее ETag. Схема читается из файла, подготовленного
+    командой generate_openapi, или генерируется при первом обращении и
+    хранится в памяти процесса до перезапуска.
+    :param schema_format: .json или .yaml
+    :return: (содержимое, ETag)
+    """
+    with _lock:
+        if schema_format not in _schemas:
+            path = settings.OPENAPI_SCHEMA_DIR / f'swagger{schema_format}'
+            content = path.read_bytes() if path.exists() \
+                else generate(schema_format)
+            etag = '"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+            _schemas[schema_format] = (content, etag)
+        return _schemas[schema_format]
+
+
+@require_safe
+def schema_file(request, format):
+    """
+    Отдать готовую схему OpenAPI с ETag
+    :param request: Объект запроса
+    :param format: .json или .yaml
+    :return: HttpResponse или 304 Not Modified
+    """
+    if format not in SCHEMA_FORMATS:
+        raise Http404
+    content, etag = load(format)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content,
+                                content_type=SCHEMA_FORMATS[format][1])
+    response.headers.setdefault('ETag', etag)
+    # Клиент кеширует схему, но проверяет ETag при каждом открытии
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -0,0 +1,109 @@
+import re
+import sys
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+
+# Служебные запросы транзакций не учитываются в бюджете
+SERVICE_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Запрос к представлению выполнил больше SQL запросов, чем разрешено
+    """
+
+
+def fingerprint(sql):
+    """
+    Получить форму запроса без значений параметров
+    :param sql: SQL запрос
+    :return: строка, одинаковая для запросов, отличающихся только значениями
+    """
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = STRING.sub('?', sql)
+    return NUMBER.sub('?', sql)
+
+
+def serializer_field():
+    """
+    Найти в стеке вызовов поле сериализатора, которое сейчас вычисляется
+    :return: строка вида Serializer.field или None
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == 'to_representation':
+            serializer = frame.f_locals.get('self')
+            field = frame.f_locals.get('field')
+            if isinstance(serializer, BaseSerializer) and field is not None:
+                return f'{type(serializer).__name__}.{field.field_name}'
+        frame = frame.f_back
+    return None
+
+
+class QueryInspector:
+    """
+    Счетчик SQL запросов, выполненных внутри блока with. В подробном режиме
+    запоминает формы запросов и поля сериализаторов, которые их вызвали.
+    """
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.count = 0
+        self.shapes = defaultdict(int)
+        self.fields = defaultdict(set)
+        self.stack = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(SERVICE_PREFIXES):
+            self.count += 1
+            if self.detailed:
+                shape = fingerprint(sql)
+                self.shapes[shape] += 1
+                field = serializer_field()
+                if field is not None:
+                    self.fields[shape].add(field)
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """
+        Получить формы запросов, выполненные не меньше threshold раз
+        :param threshold: минимальное число повторов
+        :return: список (форма, число запросов, поля сериализаторов)
+        """
+        return sorted(
+            ((shape, count, sorted(self.fields[shape]))
+             for shape, count in self.shapes.items() if count >= threshold),
+            key=lambda item: -item[1],
+        )
+
+
+def view_budget(view_func, method):
+    """
+    Получить бюджет запросов представления. Класс представления задает
+    query_budget числом или словарем {действие: число}.
+    :param view_func: функция представления из resolver
+    :param method: HTTP метод
+    :return: число или None, если бюджет не задан
+    """
+    view_class = getattr(view_func, 'cls', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if not isinstance(budget, dict):
+        return budget
+    actions = getattr(view_func, 'actions', None) or {}
+    return budget.get(actions.get(method.lower()))
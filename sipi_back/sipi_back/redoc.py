@@ -1,8 +1,6 @@
-import dataclasses
+import copy
+from collections.abc import Mapping
 
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg.views import get_schema_view
 from rest_framework import permissions, status
 
 REDOC_DESC = 'Проект по СИПИ, 6 семестр. Аналитик - бездельник.' \
@@ -26,19 +24,96 @@ SECURITY_DEFINITIONS = {
 }
 
 
-schema_view = get_schema_view(
-    openapi.Info(
+def api_info():
+    """
+    Описание API для схемы OpenAPI
+    :return: openapi.Info
+    """
+    from drf_yasg import openapi
+
+    return openapi.Info(
         title="Group Assistant API",
         default_version='v1',
         description=REDOC_DESC,
         # terms_of_service="https://www.google.com/policies/terms/",
         # contact=openapi.Contact(email="contact@snippets.local"),
         # license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
+    )
+
+
+_docs_views = {}
+
+
+def docs_view(renderer):
+    """
+    Представление интерфейса документации. drf_yasg импортируется при
+    первом обращении к документации, а не при загрузке воркера.
+    :param renderer: swagger или redoc
+    :return: функция представления
+    """
+    def view(request, *args, **kwargs):
+        if renderer not in _docs_views:
+            from drf_yasg.views import get_schema_view
+
+            schema_view = get_schema_view(
+                api_info(),
+                public=True,
+                permission_classes=[permissions.AllowAny],
+            )
+            _docs_views[renderer] = schema_view.with_ui(renderer,
+                                                        cache_timeout=0)
+        return _docs_views[renderer](request, *args, **kwargs)
+
+    return view
+
+
+class LazyOverrides(Mapping):
+    """
+    Параметры swagger_auto_schema, которые строятся при первом обращении
+    генератора схемы. drf_yasg читает их через copy.deepcopy и проверку
+    ключей, поэтому достаточно интерфейса Mapping.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.data = None
+
+    def resolve(self):
+        if self.data is None:
+            from drf_yasg.utils import swagger_auto_schema
+
+            def view_method():
+                pass
+
+            swagger_auto_schema(**self.build())(view_method)
+            self.data = view_method._swagger_auto_schema
+        return self.data
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.resolve(), memo)
+
+
+def lazy_auto_schema(overrides):
+    """
+    Аналог swagger_auto_schema без импорта drf_yasg при декорировании
+    :param overrides: функция, возвращающая параметры swagger_auto_schema
+    :return: декоратор метода представления
+    """
+    def decorator(view_method):
+        view_method._swagger_auto_schema = LazyOverrides(overrides)
+        return view_method
+
+    return decorator
 
-)
 
 access = {
     1: "Пользователь",
@@ -52,14 +127,17 @@ def sipi_redoc(description, operation_id, tag, access_level: int):
     access_list = [access[level] for level in access if level > access_level]
     access_str = ", ".join(access_list)
 
-    return swagger_auto_schema(
-        security=[{'Bearer': []}],
-        operation_description=f'{description}<br>Права доступа: '
-                              f'<b>{access.get(access_level)}<b>'
-                              f'{f", {access_str}" if access_str else ""}',
-        operation_id=operation_id,
-        tags=[tag]
-    )
+    def overrides():
+        return dict(
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag]
+        )
+
+    return lazy_auto_schema(overrides)
 
 
 def sipi_redoc_user_me(tag):
@@ -70,25 +148,32 @@ def sipi_redoc_user_me(tag):
     description = 'Возвращает информацию о своей учетной записи'
     operation_id = 'Получить информацию о себе'
 
-    return swagger_auto_schema(
-        security=[{'Bearer': []}],
-        operation_description=f'{description}<br>Права доступа: '
-                              f'<b>{access.get(access_level)}<b>'
-                              f'{f", {access_str}" if access_str else ""}',
-        operation_id=operation_id,
-        tags=[tag],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'username': openapi.Schema(type=openapi.TYPE_STRING),
-                    'personal_cipher': openapi.Schema(type=openapi.TYPE_STRING),
-                    'role': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    "user_fullname": openapi.Schema(type=openapi.TYPE_STRING)
-                },
-            ),
-        },
-    )
+    def overrides():
+        from drf_yasg import openapi
+
+        return dict(
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                200: openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'username': openapi.Schema(type=openapi.TYPE_STRING),
+                        'personal_cipher': openapi.Schema(
+                            type=openapi.TYPE_STRING),
+                        'role': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "user_fullname": openapi.Schema(
+                            type=openapi.TYPE_STRING)
+                    },
+                ),
+            },
+        )
+
+    return lazy_auto_schema(overrides)
 
 
 def sipi_queue_access():
@@ -100,51 +185,57 @@ def sipi_queue_access():
                   'очереди по предмету'
     operation_id = 'Регулировать возможность встать в очередь'
     tag = 'Предметы'
-    return swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'subject_slug': openapi.Schema(type=openapi.TYPE_STRING),
-                'is_open': openapi.Schema(type=openapi.TYPE_BOOLEAN),
-            },
-            required=['subject_slug', 'is_open']
-        ),
-        security=[{'Bearer': []}],
-        operation_description=f'{description}<br>Права доступа: '
-                              f'<b>{access.get(access_level)}<b>'
-                              f'{f", {access_str}" if access_str else ""}',
-        operation_id=operation_id,
-        tags=[tag],
-        responses={
-            status.HTTP_201_CREATED: openapi.Response(
-                description='Успешный ответ',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'success': openapi.Schema(type=openapi.TYPE_STRING)
-                    }
-                )
-            ),
-            status.HTTP_400_BAD_REQUEST: openapi.Response(
-                description='Некорректный запрос',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'error': openapi.Schema(type=openapi.TYPE_STRING)
-                    }
-                )
+
+    def overrides():
+        from drf_yasg import openapi
+
+        return dict(
+            request_body=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'subject_slug': openapi.Schema(type=openapi.TYPE_STRING),
+                    'is_open': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                },
+                required=['subject_slug', 'is_open']
             ),
-            status.HTTP_404_NOT_FOUND: openapi.Response(
-                description='Предмет не найден',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'error': openapi.Schema(type=openapi.TYPE_STRING)
-                    }
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_201_CREATED: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'success': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
+                ),
+                status.HTTP_400_BAD_REQUEST: openapi.Response(
+                    description='Некорректный запрос',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
+                ),
+                status.HTTP_404_NOT_FOUND: openapi.Response(
+                    description='Предмет не найден',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
                 )
-            )
-        },
-    )
+            },
+        )
+
+    return lazy_auto_schema(overrides)
 
 
 def queue_list_filtered():
@@ -154,57 +245,378 @@ def queue_list_filtered():
 
     description = 'Получить список человек и состояние очереди по предмету.' \
                   'Необходим фильтрующий параметр, например:' \
-                  '<code>/api/queue/filtered/?subject=ost</code>'
+                  '<code>/api/queue/filtered/?subject=ost</code><br>' \
+                  'Вместо периодических запросов можно подписаться на ' \
+                  'изменения очереди (Server-Sent Events): ' \
+                  '<code>/api/queue/events/?subject=ost&token=...</code>, ' \
+                  'токен выдает <code>/api/queue/stream-token/</code>. ' \
+                  'Первым приходит событие snapshot с этим же ' \
+                  'ответом, далее join, leave и access.'
     operation_id = 'Получить очередь по предмету'
     tag = 'Очереди'
-    return swagger_auto_schema(
-        security=[{'Bearer': []}],
-        operation_description=f'{description}<br>Права доступа: '
-                              f'<b>{access.get(access_level)}<b>'
-                              f'{f", {access_str}" if access_str else ""}',
-        operation_id=operation_id,
-        tags=[tag],
-        responses={
-            status.HTTP_201_CREATED: openapi.Response(
-                description='Успешный ответ',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'is_open': openapi.Schema(type='boolean', description='Открыта ли очередь'),
-                        'subject_name': openapi.Schema(type='string', description='Наименование предмета'),
-                        'queue_persons': openapi.Schema(
-                            type='array',
-                            items=openapi.Schema(
-                                type='object',
-                                properties={
-                                    'subject': openapi.Schema(type='string', description='Уникальный slug предмета'),
-                                    'timestamp': openapi.Schema(type='string', format='date-time', description='Временная метка'),
-                                    'subject_name': openapi.Schema(type='string', description='Наименование предмета'),
-                                    'user_fullname': openapi.Schema(type='string', description='Полное имя пользователя'),
-                                    'username': openapi.Schema(type='string', description='Имя пользователя')
-                                }
+
+    def overrides():
+        from drf_yasg import openapi
+
+        return dict(
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_201_CREATED: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'is_open': openapi.Schema(
+                                type='boolean',
+                                description='Открыта ли очередь'),
+                            'subject_name': openapi.Schema(
+                                type='string',
+                                description='Наименование предмета'),
+                            'queue_persons': openapi.Schema(
+                                type='array',
+                                items=openapi.Schema(
+                                    type='object',
+                                    properties={
+                                        'position': openapi.Schema(
+                                            type='integer',
+                                            description='Место в очереди'),
+                                        'subject': openapi.Schema(
+                                            type='string',
+                                            description='Уникальный slug '
+                                                        'предмета'),
+                                        'timestamp': openapi.Schema(
+                                            type='string',
+                                            format='date-time',
+                                            description='Временная метка'),
+                                        'subject_name': openapi.Schema(
+                                            type='string',
+                                            description='Наименование '
+                                                        'предмета'),
+                                        'user_fullname': openapi.Schema(
+                                            type='string',
+                                            description='Полное имя '
+                                                        'пользователя'),
+                                        'username': openapi.Schema(
+                                            type='string',
+                                            description='Имя пользователя')
+                                    }
+                                )
                             )
-                        )
-                    }
+                        }
+                    )
+                ),
+                status.HTTP_400_BAD_REQUEST: openapi.Response(
+                    description='Некорректный запрос',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
+                ),
+                status.HTTP_404_NOT_FOUND: openapi.Response(
+                    description='Not found',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
                 )
-            ),
-            status.HTTP_400_BAD_REQUEST: openapi.Response(
-                description='Некорректный запрос',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'error': openapi.Schema(type=openapi.TYPE_STRING)
-                    }
+            },
+        )
+
+    return lazy_auto_schema(overrides)
+
+
+def queue_position():
+    access_level = 1
+    access_list = [access[level] for level in access if level > access_level]
+    access_str = ", ".join(access_list)
+
+    description = 'Получить свое место и длину очереди по предмету. ' \
+                  'Необходим фильтрующий параметр, например:' \
+                  '<code>/api/queue/position/?subject=ost</code>'
+    operation_id = 'Получить место в очереди'
+    tag = 'Очереди'
+
+    def overrides():
+        from drf_yasg import openapi
+
+        return dict(
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_200_OK: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'subject': openapi.Schema(
+                                type='string',
+                                description='Уникальный slug предмета'),
+                            'position': openapi.Schema(
+                                type='integer',
+                                description='Место в очереди или null, если '
+                                            'пользователь не в очереди'),
+                            'queue_length': openapi.Schema(
+                                type='integer',
+                                description='Число людей в очереди')
+                        }
+                    )
+                ),
+                status.HTTP_400_BAD_REQUEST: openapi.Response(
+                    description='Некорректный запрос',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
+                ),
+                status.HTTP_404_NOT_FOUND: openapi.Response(
+                    description='Not found',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
                 )
+            },
+        )
+
+    return lazy_auto_schema(overrides)
+
+
+def queue_stream_token():
+    access_level = 1
+    access_list = [access[level] for level in access if level > access_level]
+    access_str = ", ".join(access_list)
+
+    description = 'Получить короткоживущий токен для подключения к потоку ' \
+                  'событий очереди: ' \
+                  '<code>/api/queue/events/?subject=ost&token=...</code>. ' \
+                  'Токен проверяется только при подключении, для ' \
+                  'переподключения нужно получить новый. Access токен ' \
+                  'в потоке событий не принимается, чтобы он не попадал ' \
+                  'в журналы со строкой запроса.'
+    operation_id = 'Получить токен потока событий очереди'
+    tag = 'Очереди'
+
+    def overrides():
+        from drf_yasg import openapi
+        from drf_yasg.utils import no_body
+
+        return dict(
+            request_body=no_body,
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_200_OK: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'token': openapi.Schema(
+                                type='string',
+                                description='Токен потока событий'),
+                            'expires_in': openapi.Schema(
+                                type='integer',
+                                description='Время жизни токена в секундах')
+                        }
+                    )
+                ),
+            },
+        )
+
+    return lazy_auto_schema(overrides)
+
+
+def sync_changes():
+    access_level = 1
+    access_list = [access[level] for level in access if level > access_level]
+    access_str = ", ".join(access_list)
+
+    description = 'Получить изменения предметов, очередей, опросов, ' \
+                  'вариантов и посещаемости после курсора, например: ' \
+                  '<code>/api/sync/?since=1520&limit=500</code>. ' \
+                  'Первый запрос выполняется с <code>since=0</code>, ' \
+                  'следующие - с полученным cursor, пока has_more=true. ' \
+                  'Для каждого объекта приходит только последнее ' \
+                  'изменение: upsert с текущими данными или delete. ' \
+                  'При reset=true журнал уже сжат: нужно заново загрузить ' \
+                  'списки и продолжить с полученного cursor.'
+    operation_id = 'Получить изменения'
+    tag = 'Синхронизация'
+
+    def overrides():
+        from drf_yasg import openapi
+
+        change = openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'seq': openapi.Schema(
+                    type='integer',
+                    description='Номер записи журнала'),
+                'model': openapi.Schema(
+                    type='string',
+                    description='subject, queue, poll, choice или attendance'),
+                'id': openapi.Schema(type='integer', description='id объекта'),
+                'action': openapi.Schema(
+                    type='string',
+                    description='upsert или delete'),
+                'data': openapi.Schema(
+                    type='object',
+                    description='Данные объекта, как в списке модели, или '
+                                'null при удалении'),
+            }
+        )
+        return dict(
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_200_OK: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'reset': openapi.Schema(
+                                type='boolean',
+                                description='Курсор устарел, нужна полная '
+                                            'загрузка'),
+                            'cursor': openapi.Schema(
+                                type='integer',
+                                description='Курсор для следующего запроса'),
+                            'has_more': openapi.Schema(
+                                type='boolean',
+                                description='Есть еще изменения'),
+                            'changes': openapi.Schema(
+                                type='array',
+                                items=change),
+                        }
+                    )
+                ),
+                status.HTTP_400_BAD_REQUEST: openapi.Response(
+                    description='Некорректный запрос',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'error': openapi.Schema(type=openapi.TYPE_STRING)
+                        }
+                    )
+                ),
+            },
+        )
+
+    return lazy_auto_schema(overrides)
+
+
+def batch_requests():
+    access_level = 1
+    access_list = [access[level] for level in access if level > access_level]
+    access_str = ", ".join(access_list)
+
+    description = 'Выполнить несколько запросов к API за один ' \
+                  'HTTP запрос. Вложенные запросы выполняются по порядку ' \
+                  'от имени текущего пользователя с теми же правами, что ' \
+                  'и отдельные запросы. При <code>atomic=true</code> все ' \
+                  'запросы выполняются в одной транзакции: первый ответ ' \
+                  'со статусом 400 и выше останавливает пакет и ' \
+                  'откатывает изменения (rolled_back=true). Ошибка ' \
+                  'сервера во вложенном запросе возвращается в его ' \
+                  'результате со статусом 500. Вложенные запросы не ' \
+                  'проходят middleware: журнал запросов, метрики и ' \
+                  'бюджет SQL запросов учитывают пакет целиком.'
+    operation_id = 'Выполнить пакет запросов'
+    tag = 'Пакетные запросы'
+
+    def overrides():
+        from drf_yasg import openapi
+
+        return dict(
+            request_body=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'atomic': openapi.Schema(
+                        type=openapi.TYPE_BOOLEAN,
+                        description='Выполнить в одной транзакции'),
+                    'requests': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'method': openapi.Schema(
+                                    type=openapi.TYPE_STRING,
+                                    description='GET, POST, PUT, PATCH или '
+                                                'DELETE'),
+                                'path': openapi.Schema(
+                                    type=openapi.TYPE_STRING,
+                                    description='Путь со строкой запроса, '
+                                                'например /api/queue/'
+                                                'position/?subject=ost'),
+                                'body': openapi.Schema(
+                                    type=openapi.TYPE_OBJECT,
+                                    description='Тело запроса'),
+                            },
+                            required=['method', 'path']
+                        )
+                    ),
+                },
+                required=['requests']
             ),
-            status.HTTP_404_NOT_FOUND: openapi.Response(
-                description='Not found',
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'error': openapi.Schema(type=openapi.TYPE_STRING)
-                    }
-                )
-            )
-        },
-    )
+            security=[{'Bearer': []}],
+            operation_description=f'{description}<br>Права доступа: '
+                                  f'<b>{access.get(access_level)}<b>'
+                                  f'{f", {access_str}" if access_str else ""}',
+            operation_id=operation_id,
+            tags=[tag],
+            responses={
+                status.HTTP_200_OK: openapi.Response(
+                    description='Успешный ответ',
+                    schema=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'rolled_back': openapi.Schema(
+                                type=openapi.TYPE_BOOLEAN),
+                            'results': openapi.Schema(
+                                type=openapi.TYPE_ARRAY,
+                                items=openapi.Schema(
+                                    type=openapi.TYPE_OBJECT,
+                                    properties={
+                                        'status': openapi.Schema(
+                                            type=openapi.TYPE_INTEGER),
+                                        'headers': openapi.Schema(
+                                            type=openapi.TYPE_OBJECT),
+                                        'body': openapi.Schema(
+                                            type=openapi.TYPE_OBJECT),
+                                    }
+                                )
+                            ),
+                        }
+                    )
+                ),
+                status.HTTP_400_BAD_REQUEST: openapi.Response(
+                    description='Некорректный пакет'
+                ),
+            },
+        )
+
+    return lazy_auto_schema(overrides)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -49,7 +50,6 @@ INSTALLED_APPS = [
 
     # Third-party apps
     'rest_framework',
-    'drf_yasg',
     'djoser',
     'django_filters',
 
@@ -58,6 +58,14 @@ INSTALLED_APPS = [
     'core',
 ]
 
+# Документация API (swagger, redoc). drf_yasg подключается только если
+# она включена, а импортируется при первом обращении к ней
+API_DOCS_ENABLED = os.getenv(
+    'API_DOCS_ENABLED', 'True').lower() in ('true', '1', 't')
+
+if API_DOCS_ENABLED:
+    INSTALLED_APPS.append('drf_yasg')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -70,7 +78,8 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     # custom
-    'sipi_back.middlewares.RequestLoggingMiddleware'
+    'sipi_back.middlewares.RequestLoggingMiddleware',
+    'sipi_back.middlewares.QueryInspectionMiddleware',
 ]
 
 ROOT_URLCONF = 'sipi_back.urls'
@@ -170,8 +179,11 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        'core.authentication.CachedJWTAuthentication',
+    ],
+    # Списки постраничные только при параметре cursor или page_size
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.OptionalCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 SIMPLE_JWT = {
@@ -179,6 +191,40 @@ SIMPLE_JWT = {
    'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Кеш пользователей для JWT аутентификации в памяти каждого воркера.
+# RECHECK - как часто сверять версию пользователя с базой, то есть через
+# сколько секунд смена роли видна в остальных воркерах
+JWT_USER_CACHE = {
+    'MAX_SIZE': int(os.getenv('JWT_USER_CACHE_SIZE', 1024)),
+    'TTL': int(os.getenv('JWT_USER_CACHE_TTL', 60)),
+    'RECHECK': float(os.getenv('JWT_USER_CACHE_RECHECK', 5)),
+}
+
+# Число шардов счетчика голосов для опросов с sharded_votes
+VOTE_COUNTER_SHARDS = int(os.getenv('VOTE_COUNTER_SHARDS', 16))
+
+# Число процессов для хеширования паролей при массовом импорте пользователей
+USER_IMPORT_HASH_WORKERS = int(os.getenv('USER_IMPORT_HASH_WORKERS',
+                                         os.cpu_count() or 1))
+
+# Компактное хранение посещаемости: одна строка масок на предмет и студента
+# вместо строки на каждое занятие. Переключать вместе с командой
+# convert_attendance_storage
+ATTENDANCE_BITSET_STORAGE = os.getenv(
+    'ATTENDANCE_BITSET_STORAGE', 'False').lower() in ('true', '1', 't')
+
+# Журнал изменений для /api/sync/: записи новее этого числа секунд могут
+# принадлежать незафиксированным транзакциям, курсор их не пропускает
+CHANGELOG_SETTLE_SECONDS = int(os.getenv('CHANGELOG_SETTLE_SECONDS', 5))
+
+# Срок хранения записей об удалении при сжатии журнала изменений
+CHANGELOG_RETENTION_DAYS = int(os.getenv('CHANGELOG_RETENTION_DAYS', 30))
+
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+
+# Максимальное число вложенных запросов в /api/batch/
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+
 # ------Logging Configuration------
 LOGS_DIR = BASE_DIR / 'logs'
 
@@ -189,33 +235,75 @@ LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'sipi_formatter': {
-            'format': '{levelname} {message}',
-            'style': '{',
-        }
+        'json': {
+            '()': 'sipi_back.log_handlers.JsonFormatter',
+        },
     },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
+        # Запись в файл и консоль идет из фонового потока, запрос только
+        # кладет запись в очередь
+        'async': {
+            '()': 'sipi_back.log_handlers.AsyncLogHandler',
             'level': 'INFO',
-            'formatter': 'sipi_formatter',
-        },
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'formatter': 'json',
             'filename': LOGS_DIR / 'app.log',
-            'formatter': 'sipi_formatter',
+            'max_bytes': int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024)),
+            'backup_count': int(os.getenv('LOG_BACKUP_COUNT', 10)),
+            'when': os.getenv('LOG_ROTATE_WHEN', 'D'),
+            'queue_size': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
         },
     },
     'loggers': {
         '': {
-            'handlers': ['file', 'console'],
+            'handlers': ['async'],
             'level': 'INFO',
         },
     },
 }
 
 
+# Счетчики запросов по маршрутам, каждый воркер сохраняет свой файл
+METRICS_DIR = Path(os.getenv('METRICS_DIR', BASE_DIR / 'metrics'))
+
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+
+# Поиск N+1 запросов: включать на разработке и стенде
+QUERY_INSPECTION = os.getenv(
+    'QUERY_INSPECTION', str(DEBUG)).lower() in ('true', '1', 't')
+
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.getenv('QUERY_N_PLUS_ONE_THRESHOLD', 5))
+
+# Превышение query_budget представления: исключение в тестах
+# (manage.py test или pytest), предупреждение в логе в остальных случаях
+QUERY_BUDGET_STRICT = os.getenv(
+    'QUERY_BUDGET_STRICT',
+    str(sys.argv[1:2] == ['test'] or 'pytest' in sys.modules)
+).lower() in ('true', '1', 't')
+
+
+# Журнал медленных SQL запросов с планами EXPLAIN, по умолчанию выключен
+SLOW_QUERY_LOG = os.getenv(
+    'SLOW_QUERY_LOG', 'False').lower() in ('true', '1', 't')
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 200))
+
+
+# Брокер событий очередей для SSE: LocalBroker в одном процессе,
+# UnixSocketBroker для рассылки между воркерами gunicorn и ASGI
+QUEUE_EVENTS_BROKER = os.getenv('QUEUE_EVENTS_BROKER',
+                                'sipi_back.events.LocalBroker')
+
+EVENTS_SOCKET_DIR = Path(
+    os.getenv('EVENTS_SOCKET_DIR', BASE_DIR / 'run' / 'events'))
+
+# Время жизни токена подключения к потоку событий очереди
+QUEUE_EVENTS_TOKEN_LIFETIME = timedelta(
+    seconds=int(os.getenv('QUEUE_EVENTS_TOKEN_SECONDS', 60)))
+
+
 # ----- Swagger settings (redoc) -----
 
 # FORCE_SCRIPT_NAME = 'https://assistant.5pwjust.ru'
@@ -231,9 +319,18 @@ SWAGGER_SETTINGS = {
             'name': 'Authorization',
             'in': 'header'
         }
-    }
+    },
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
 }
 
+# Схема OpenAPI, сгенерированная командой generate_openapi при развертывании
+OPENAPI_SCHEMA_DIR = Path(
+    os.getenv('OPENAPI_SCHEMA_DIR', BASE_DIR / 'openapi'))
+
 
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -0,0 +1,147 @@
+import datetime
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# Для EXPLAIN берутся только запросы чтения, чтобы не выполнять изменения
+EXPLAINABLE_PREFIXES = ('SELECT', 'WITH')
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+current = threading.local()
+
+
+def set_current_view(name):
+    """
+    Запомнить представление, которое обрабатывает запрос в этом потоке
+    :param name: имя маршрута или None
+    :return: None
+    """
+    current.view = name
+
+
+def params_shape(params, many):
+    """
+    Получить типы параметров запроса без самих значений
+    :param params: параметры запроса
+    :param many: executemany
+    :return: список имен типов или описание пачки
+    """
+    if many:
+        params = list(params or [])
+        shape = params_shape(params[0], False) if params else []
+        return {'rows': len(params), 'row': shape}
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params or ()]
+
+
+class SlowQueryLog:
+    """
+    Кольцевой буфер медленных SQL запросов процесса. Обертка выполнения
+    запросов замеряет время, а планы EXPLAIN снимает фоновый поток на
+    собственном соединении с базой данных.
+    """
+
+    def __init__(self, threshold_ms, size):
+        self.threshold = threshold_ms / 1000
+        self.records = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.explain_queue = None
+        self.pid = None
+
+    def start(self):
+        """
+        Запустить поток EXPLAIN в текущем процессе
+        :return: None
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.records.clear()
+            self.explain_queue = queue.Queue(self.records.maxlen)
+            self.pid = os.getpid()
+        threading.Thread(target=self.explain_loop, name='slow-query-explain',
+                         daemon=True).start()
+
+    def install(self, sender, connection, **kwargs):
+        """
+        Обработчик сигнала connection_created: подключить обертку к
+        соединению один раз
+        """
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(current, 'explaining', False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                self.add(sql, params, many, duration,
+                         context['connection'].alias)
+
+    def add(self, sql, params, many, duration, alias):
+        """
+        Сохранить медленный запрос и поставить его в очередь на EXPLAIN
+        :return: None
+        """
+        if self.pid != os.getpid():
+            self.start()
+        vendor = connections[alias].vendor
+        record = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'view': getattr(current, 'view', None),
+            'sql': sql,
+            'params': params_shape(params, many),
+            'vendor': vendor,
+            'plan': None,
+        }
+        with self.lock:
+            self.records.append(record)
+        if not many and vendor in EXPLAIN_PREFIXES and \
+                sql.lstrip().upper().startswith(EXPLAINABLE_PREFIXES):
+            try:
+                self.explain_queue.put_nowait((record, alias, sql, params))
+            except queue.Full:
+                record['plan'] = 'skipped: explain queue is full'
+
+    def explain_loop(self):
+        current.explaining = True
+        while True:
+            record, alias, sql, params = self.explain_queue.get()
+            connection = connections[alias]
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(EXPLAIN_PREFIXES[connection.vendor] + sql,
+                                   params)
+                    record['plan'] = '\n'.join(
+                        ' '.join(str(column) for column in row)
+                        for row in cursor.fetchall())
+            except DatabaseError as error:
+                record['plan'] = f'error: {error}'
+                connection.close()
+
+    def list(self):
+        """
+        Получить сохраненные медленные запросы, новые первыми
+        :return: список словарей
+        """
+        with self.lock:
+            return [dict(record) for record in reversed(self.records)]
+
+
+slow_query_log = SlowQueryLog(settings.SLOW_QUERY_THRESHOLD_MS,
+                              settings.SLOW_QUERY_LOG_SIZE)
@@ -1,4 +1,16 @@
 #!/bin/bash
+# События очередей рассылаются между воркерами gunicorn и ASGI сервером
+export QUEUE_EVENTS_BROKER=${QUEUE_EVENTS_BROKER:-sipi_back.events.UnixSocketBroker}
+
 python manage.py migrate --noinput && \
 python manage.py collectstatic --noinput && \
+python manage.py reset_metrics && \
+python manage.py generate_openapi || exit 1
+
+# Журнал изменений для /api/sync/ сжимается раз в час
+(while sleep 3600; do python manage.py compact_changelog; done) &
+
+# Живые обновления очередей (Server-Sent Events) обслуживает ASGI сервер
+uvicorn sipi_back.asgi:application --host 0.0.0.0 --port 8001 --workers 2 &
+
 gunicorn -w 3 -b 0.0.0.0:8000 sipi_back.wsgi:application